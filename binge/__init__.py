@@ -1,13 +1,45 @@
 import os
-from .binge import B
+import sys
+import types
+from .binge import B, shared_pool, close_shared_pools
 from ._version import __version__, __major__, __minor__, __micro__
 
 _PATH = os.path.dirname(os.path.abspath(__file__))
 _PATH = _PATH.split(os.path.sep)[:-1]
 
-try:
-    __doc__ = """
+
+class _Module(types.ModuleType):
+    """
+    The binge module, whose doc is only read from the README when asked for
+    """
+
+    @property
+    def __doc__(self):
+        doc = self.__dict__.get('_doc')
+        if doc is None:
+            try:
+                doc = """
               {0}
               """.format(open(os.path.join(os.path.sep, os.path.sep.join(_PATH), 'README.rst'), 'r').read())
-except:
-    __doc__ = ""
+            except:
+                doc = ""
+            self.__dict__['_doc'] = doc
+        return doc
+
+
+sys.modules[__name__].__class__ = _Module
+
+# names imported on first access, with the modules they come from
+_LAZY: dict = {'Pipeline': '._pipeline', 'TaskError': '._resilient', 'register_serializer': '._serialize'}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    import importlib
+    value = globals()[name] = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(_LAZY))
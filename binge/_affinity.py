@@ -0,0 +1,182 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import glob
+import itertools
+import multiprocessing
+import os
+import threading
+import uuid
+
+
+# environment variables read by the native thread pools of BLAS, OpenMP and co
+_NATIVE_VARS: tuple = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                       'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# worker-side setup already applied, one per thread
+_LOCAL = threading.local()
+_SLOTS = itertools.count()
+
+# identifies the current process, renewed in forked children
+_PROCESS: list = [uuid.uuid4().hex]
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: _PROCESS.__setitem__(0, uuid.uuid4().hex))
+
+
+def available_cpus() -> list:
+    """
+    Returns the CPUs the current process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_index(n_threads: int) -> int:
+    """
+    Returns the index of the current worker among `n_threads`, derived
+    like that of _pinfo for processes, and in order of first call for
+    threads
+    """
+    identity = multiprocessing.current_process()._identity
+    if identity:
+        return identity[0] % n_threads
+    slot = getattr(_LOCAL, 'slot', None)
+    if slot is None:
+        slot = _LOCAL.slot = next(_SLOTS)
+    return slot % n_threads
+
+
+def parse_cpulist(cpulist: str) -> list:
+    """
+    Returns the CPUs of a kernel cpulist such as '0-3,8,10-11'
+    """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus += range(int(first), int(last) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes() -> list:
+    """
+    Returns the CPUs available to the process grouped by NUMA node, or
+    in a single group if the topology cannot be read
+    """
+    available = set(available_cpus())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'),
+                       key=lambda path: int(path.split('/')[-2][4:])):
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+
+def core_sets(n_workers: int, nodes: list) -> list:
+    """
+    Splits the CPUs of `nodes` into one core set per worker. Workers are
+    spread round-robin over the NUMA nodes so that the memory bandwidth of
+    all sockets is used, and the CPUs of each node are split into
+    contiguous sets among its workers, which share them if outnumbering them
+    """
+    sets = []
+    for idx in range(n_workers):
+        cpus = nodes[idx % len(nodes)]
+        # number of workers on this node and rank of this one among them
+        count = len(range(idx % len(nodes), n_workers, len(nodes)))
+        rank = idx // len(nodes)
+        if count <= len(cpus):
+            sets.append(cpus[rank * len(cpus) // count:(rank + 1) * len(cpus) // count])
+        else:
+            sets.append([cpus[rank % len(cpus)]])
+    return sets
+
+
+def limit_native_threads(n: int) -> None:
+    """
+    Caps the native thread pools of the current process to `n` threads:
+    through the environment for the libraries loaded from now on, and
+    through threadpoolctl, if installed, for those already loaded
+    """
+    for var in _NATIVE_VARS:
+        os.environ[var] = str(n)
+    try:
+        # threadpoolctl is only required to cap libraries already loaded
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=n)
+
+
+class PinCall(object):
+    """
+    Callable which pins the worker process running it to its core set and
+    caps its native thread pools, once per worker, before calling fct.
+    Nothing is changed when it runs in the process which created it, e.g.
+    when backend 'auto' runs the iterations there, as the settings would
+    outlive the call
+    """
+
+    def __init__(self, fct: Callable, affinity: bool or list or None, native_threads: int or str or None,
+                 n_threads: int):
+        self.fct: Callable = fct
+        self.affinity: bool or list or None = affinity
+        self.native_threads: int or str or None = native_threads
+        self.n_threads: int = n_threads
+        self.origin: str = _PROCESS[0]
+
+    def _setup(self) -> None:
+        setup = (self.affinity, self.native_threads, self.n_threads)
+        if getattr(_LOCAL, 'setup', None) == setup:
+            return
+        _LOCAL.setup = setup
+        index = worker_index(self.n_threads)
+        cpus = None
+        if self.affinity is True:
+            cpus = core_sets(self.n_threads, numa_nodes())[index]
+        elif self.affinity:
+            cpus = list(self.affinity[index % len(self.affinity)])
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            # on Linux, pins the calling thread only
+            os.sched_setaffinity(0, cpus)
+        if self.native_threads == 'auto':
+            limit_native_threads(len(cpus) if cpus is not None else
+                                 max(1, len(available_cpus()) // self.n_threads))
+        elif self.native_threads is not None:
+            limit_native_threads(self.native_threads)
+
+    def __call__(self, *args, **kwargs):
+        if self.origin != _PROCESS[0]:
+            self._setup()
+        return self.fct(*args, **kwargs)
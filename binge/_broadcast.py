@@ -0,0 +1,187 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import hashlib
+import pickle
+from multiprocessing import shared_memory
+
+
+# worker-side cache of the broadcast (fct, args, kwargs), by hash of their payload
+_INSTALLED: dict = {}
+
+# worker-side (segment name, size) of the data stored on a cluster node, by key
+_REMOTE: dict = {}
+
+
+def install_remote(stored: dict) -> None:
+    """
+    Records the segments holding the data stored on the node of the worker
+    """
+    _REMOTE.update(stored)
+
+
+class Broadcast(object):
+    """
+    Pickles fct and the inputs which are the same for all iterations once
+    into a shared memory segment, from which each worker loads them once.
+    `digest` is the hash of the payload, if the workers cache it
+    """
+
+    def __init__(self, payload: bytes, digest: str or None = None):
+        self.digest: str or None = digest
+        self.size: int = len(payload)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, self.size))
+        self.shm.buf[:self.size] = payload
+
+    def release(self) -> None:
+        """
+        Frees the shared memory segment
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RemoteBroadcast(object):
+    """
+    Payload stored once on each node of a cluster pool
+    """
+
+    def __init__(self, pool, payload: bytes, digest: str):
+        self.pool = pool
+        self.digest: str = digest
+        self.size: int = len(payload)
+        self.key: str = pool.put(payload)
+
+    def release(self) -> None:
+        """
+        Frees the payload on the nodes
+        """
+        self.pool.drop(self.key)
+
+
+class BroadcastCall(object):
+    """
+    Callable which calls the broadcast fct with the broadcast inputs
+    merged back into the per-iteration inputs it receives
+    """
+
+    def __init__(self, broadcast: Broadcast, largs: int, loads: Callable = pickle.loads):
+        self.digest: str = broadcast.digest
+        self.name: str = broadcast.shm.name
+        self.size: int = broadcast.size
+        self.largs: int = largs
+        self.loads: Callable = loads
+
+    def _segment(self) -> tuple:
+        """
+        Returns the name and size of the segment holding the payload
+        """
+        return self.name, self.size
+
+    def _install(self) -> tuple:
+        """
+        Returns the broadcast (fct, args, kwargs), loading them on first
+        use. They are cached by the hash of their payload, so that calls
+        which broadcast the same ones do not load them again. Loading new
+        ones drops those of previous calls
+        """
+        installed = _INSTALLED.get(self.digest)
+        if installed is None:
+            _INSTALLED.clear()
+            name, size = self._segment()
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                installed = self.loads(shm.buf[:size])
+            finally:
+                shm.close()
+            _INSTALLED[self.digest] = installed
+        return installed
+
+    def __call__(self, *args, **kwargs):
+        fct, const_args, const_kwargs = self._install()
+        args = iter(args)
+        full_args = [const_args[idx] if idx in const_args else next(args) for idx in range(self.largs)]
+        return fct(*full_args, **const_kwargs, **kwargs)
+
+
+class RemoteBroadcastCall(BroadcastCall):
+    """
+    BroadcastCall loading the payload from the segment in which the node
+    of the worker stored it
+    """
+
+    def __init__(self, broadcast: RemoteBroadcast, largs: int, loads: Callable = pickle.loads):
+        self.digest: str = broadcast.digest
+        self.key: str = broadcast.key
+        self.largs: int = largs
+        self.loads: Callable = loads
+
+    def _segment(self) -> tuple:
+        return _REMOTE[self.key]
+
+
+def broadcast(fct: Callable, params: list, min_size: int, keep: set = frozenset(), serializer=None,
+              remote=None, cached: Broadcast or RemoteBroadcast or None = None) -> tuple:
+    """
+    Takes the inputs which are the same for all iterations out of params,
+    in place, except those at row positions `keep`. Returns the callable
+    to send to the workers instead of fct, the Broadcast to release after
+    the call, and the row positions of the inputs taken out. Nothing is
+    done if the pickled fct and inputs are smaller than `min_size` bytes.
+    They are pickled with `serializer` if given and it outputs bytes.
+    With a cluster pool `remote`, they are stored once on each of its
+    nodes instead. The Broadcast `cached` of a previous call is returned
+    instead of a new one if it holds the same payload
+    """
+    largs = len(params[0])
+    const_args = {idx: item[0] for idx, item in enumerate(params[0]) if len(item) == 1 and idx not in keep}
+    const_kwargs = {key: item[0] for pos, (key, item) in enumerate(params[1].items(), largs)
+                    if len(item) == 1 and pos not in keep}
+    if serializer is not None and serializer.bytes_only:
+        payload, loads = serializer.dumps((fct, const_args, const_kwargs)), serializer.loads
+    else:
+        payload, loads = pickle.dumps((fct, const_args, const_kwargs), protocol=pickle.HIGHEST_PROTOCOL), pickle.loads
+    if len(payload) < min_size:
+        return fct, None, []
+    digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+    if cached is not None and cached.digest == digest and getattr(cached, 'pool', None) is remote:
+        bcast = cached
+    elif remote is not None:
+        bcast = RemoteBroadcast(remote, payload, digest)
+    else:
+        bcast = Broadcast(payload, digest)
+    if remote is not None:
+        call = RemoteBroadcastCall(bcast, largs, loads)
+    else:
+        call = BroadcastCall(bcast, largs, loads)
+    removed = list(const_args) + [pos for pos, key in enumerate(params[1], largs) if key in const_kwargs]
+    params[0][:] = [item for idx, item in enumerate(params[0]) if idx not in const_args]
+    for key in const_kwargs:
+        del params[1][key]
+    return call, bcast, removed
@@ -0,0 +1,169 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+
+class Cache(object):
+    """
+    Directory of the outputs of iterations, one pickle file per iteration
+    named after the hash of fct and of the iteration inputs
+
+    Args:
+      * path (str): the directory, created if need be
+      * max_size (int or None): the total size in bytes above which the
+        oldest outputs are evicted. None means no limit
+      * max_age (float or None): the age in seconds above which outputs
+        are evicted. None means no limit
+    """
+
+    def __init__(self, path: str, max_size: int or None = None, max_age: float or None = None):
+        self.path: str = os.path.abspath(path)
+        self.max_size: int or None = max_size
+        self.max_age: float or None = max_age
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def fct_token(fct: Callable) -> bytes:
+        """
+        Returns what identifies fct across runs: its pickled reference and
+        its bytecode, so that editing fct invalidates its outputs
+        """
+        code = getattr(fct, '__code__', None)
+        try:
+            token = pickle.dumps(fct, protocol=4)
+        except Exception:
+            token = repr((getattr(fct, '__module__', None), getattr(fct, '__qualname__', None))).encode()
+        if code is not None:
+            token += code.co_code + repr(code.co_consts).encode()
+        return token
+
+    @staticmethod
+    def key(token: bytes, names: tuple, row: tuple) -> str or None:
+        """
+        Returns the hash of an iteration, or None if its inputs cannot be
+        pickled
+        """
+        try:
+            return hashlib.sha256(token + pickle.dumps((names, row), protocol=4)).hexdigest()
+        except Exception:
+            return None
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def get(self, key: str or None) -> tuple:
+        """
+        Returns whether the output of iteration `key` is cached, and the
+        output if so
+        """
+        if key is None:
+            return False, None
+        path = self._file(key)
+        try:
+            if self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age:
+                return False, None
+            with open(path, 'rb') as f:
+                return True, pickle.load(f)
+        except Exception:
+            # missing, or partially written by a run which crashed
+            return False, None
+
+    def put(self, key: str or None, value) -> None:
+        """
+        Stores the output of iteration `key`, atomically so that an
+        interrupted run never leaves a corrupted entry
+        """
+        if key is None:
+            return
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception:
+            # outputs which cannot be pickled are not cached
+            os.remove(tmp)
+
+    def evict(self) -> None:
+        """
+        Removes the outputs older than max_age, then the oldest ones until
+        the total size is below max_size
+        """
+        if self.max_size is None and self.max_age is None:
+            return
+        entries = []
+        for folder in os.scandir(self.path):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith('.pkl'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if (self.max_age is not None and now - mtime > self.max_age) or \
+                    (self.max_size is not None and total > self.max_size):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self) -> None:
+        """
+        Removes all outputs
+        """
+        for folder in os.scandir(self.path):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    os.remove(entry.path)
+
+
+class CacheWrite(object):
+    """
+    Callable which stores the output of fct in the cache as soon as it is
+    computed, so that an interrupted run resumes from there
+    """
+
+    def __init__(self, fct: Callable, cache: Cache):
+        self.fct: Callable = fct
+        self.cache: Cache = cache
+
+    def __call__(self, *args, _binge_key: str or None, **kwargs):
+        res = self.fct(*args, **kwargs)
+        self.cache.put(_binge_key, res)
+        return res
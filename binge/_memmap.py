@@ -0,0 +1,144 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import itertools
+import os
+import tempfile
+
+
+# worker-side memory-mapped output of the running task, by output key
+_OPENED: dict = {}
+_KEYS = itertools.count()
+
+
+class MemmapOutput(object):
+    """
+    Output ndarray of shape (n,) + shape preallocated in the .npy file
+    `path`, or in a new temporary file if None, which is removed once the
+    output is collected. The missing shape or dtype are taken from the
+    output `first` of the first iteration
+    """
+
+    def __init__(self, path: str or None, n: int, first=None, shape: tuple or None = None,
+                 dtype: str or None = None):
+        from numpy import asarray, dtype as np_dtype
+        from numpy.lib.format import open_memmap
+        if first is not None:
+            first = asarray(first)
+            shape = first.shape if shape is None else shape
+            dtype = first.dtype if dtype is None else dtype
+        self.temporary: bool = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.npy', prefix='binge_')
+            os.close(fd)
+        self.path: str = os.path.abspath(path)
+        self.shape: tuple = (int(n),) + tuple(shape)
+        self.dtype: str = np_dtype(dtype).str
+        self.array = open_memmap(self.path, mode='w+', dtype=self.dtype, shape=self.shape)
+        self.offset: int = self.array.offset
+        self.key: tuple = (os.getpid(), next(_KEYS))
+
+    def result(self, stack: bool = False):
+        """
+        Returns the output as a np.memmap on the file, stacked along its
+        first dimension if `stack`
+        """
+        from numpy.lib.format import open_memmap
+        self.array.flush()
+        self.array = None
+        # the serial and thread backends write from this process
+        _OPENED.pop(self.key, None)
+        arr = open_memmap(self.path, mode='r+')
+        if self.temporary:
+            # the mapping outlives the file
+            try:
+                os.remove(self.path)
+            except OSError:
+                # e.g. on Windows, where a mapped file cannot be removed
+                pass
+        if stack and arr.ndim > 1:
+            return arr.reshape((-1,) + arr.shape[2:])
+        return arr
+
+    def release(self) -> None:
+        """
+        Removes the file, which is incomplete
+        """
+        self.array = None
+        _OPENED.pop(self.key, None)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class MemmapWrite(object):
+    """
+    Callable which writes the output of fct into its slot of a
+    preallocated memory-mapped output file, instead of returning it
+    """
+    # the slot is given by the iteration index
+    needs_index: bool = True
+
+    def __init__(self, fct: Callable, out: MemmapOutput):
+        self.fct: Callable = fct
+        self.path: str = out.path
+        self.offset: int = out.offset
+        self.shape: tuple = out.shape
+        self.dtype: str = out.dtype
+        self.key: tuple = out.key
+
+    def _open(self):
+        """
+        Returns the output mapped in the worker, mapping it on first use
+        in the task
+        """
+        arr = _OPENED.get(self.key)
+        if arr is None:
+            from numpy import memmap
+            _OPENED.clear()
+            arr = _OPENED[self.key] = memmap(self.path, dtype=self.dtype, mode='r+', offset=self.offset,
+                                             shape=self.shape)
+        return arr
+
+    def __call__(self, *args, _binge_index: int, **kwargs):
+        res = self.fct(*args, **kwargs)
+        self._open()[_binge_index] = res
+
+    def end_task(self) -> None:
+        """
+        Flushes the output written by the task, for it to reach a shared
+        file system, and unmaps it
+        """
+        arr = _OPENED.pop(self.key, None)
+        if arr is not None:
+            arr.flush()
+        end_task = getattr(self.fct, 'end_task', None)
+        if end_task is not None:
+            end_task()
@@ -0,0 +1,156 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import copy
+
+from .binge import B
+
+
+class Fused(object):
+    """
+    Callable which runs fused stages back to back, each on the output of
+    the previous one
+    """
+
+    def __init__(self, fcts: list):
+        self.fcts: list = fcts
+
+    def __call__(self, *args, **kwargs):
+        res = self.fcts[0](*args, **kwargs)
+        for fct in self.fcts[1:]:
+            res = fct(res)
+        return res
+
+
+def _streams_out(stage: B) -> bool:
+    """
+    Whether the outputs of `stage` can be handed to the next one item by
+    item as they come, which is when the stage returns them as a plain list
+    """
+    return (stage.type_out is None and stage._reducer is None and not stage._product and stage.blocks is None and
+            stage.cache is None and not stage._resilient)
+
+
+def _streams_in(stage: B) -> bool:
+    """
+    Whether `stage` can consume its input item by item as it comes, which
+    is when it would split it element-wise anyway
+    """
+    return (stage._n is None and stage.blocks is None and not stage._product and stage.groupby is None and
+            stage.cache is None and not stage._resilient)
+
+
+def _fuses(prev: B, stage: B) -> bool:
+    """
+    Whether `stage` can run in the same task as `prev`, on its output
+    """
+    return (_streams_out(prev) and _streams_in(stage) and not stage._fwd_pinfo and
+            stage.backend == prev.backend and stage.threads == prev.threads and stage.nodes == prev.nodes)
+
+
+class Pipeline(object):
+    """
+    Chains B stages, each called with the output of the previous one as
+    its single input and keeping its own type_in and type_out semantics
+
+    Consecutive element-wise stages which run on the same backend are
+    fused: each task runs them back to back in the same worker, so the
+    intermediate outputs never go through the parent. Between the other
+    stages, the items stream: a stage whose outputs are a plain list hands
+    them to the next stage as they come, so that it starts before the
+    previous one finishes. The other stages are run one after the other
+
+    Args:
+      * stages (B or callable): the stages, in order. Callables which are
+        not B instances are wrapped with B defaults
+
+    Also built with B(f) | B(g) | B(h)
+    """
+
+    def __init__(self, *stages):
+        self.stages: list = []
+        for stage in stages:
+            if isinstance(stage, Pipeline):
+                self.stages += stage.stages
+            else:
+                self.stages.append(stage if isinstance(stage, B) else B(stage))
+        if not self.stages:
+            raise ValueError("a pipeline needs at least one stage")
+
+    def __or__(self, other) -> Pipeline:
+        return Pipeline(self, other)
+
+    def __ror__(self, other) -> Pipeline:
+        return Pipeline(other, self)
+
+    def __repr__(self):
+        return ' | '.join(str(stage) for stage in self.stages)
+
+    def _groups(self) -> list:
+        """
+        Returns the stages cut into groups of fused stages
+        """
+        groups = [[self.stages[0]]]
+        for stage in self.stages[1:]:
+            if _fuses(groups[-1][-1], stage):
+                groups[-1].append(stage)
+            else:
+                groups.append([stage])
+        return groups
+
+    @staticmethod
+    def _fuse(group: list) -> B:
+        """
+        Returns a B running the stages of `group` in a single task, with the
+        inputs of the first stage and the outputs of the last one
+        """
+        first, last = group[0], group[-1]
+        fused = copy.copy(first)
+        if len(group) > 1:
+            fused._fct = Fused([stage._task_fct() for stage in group])
+            # already applied by each stage
+            fused._worker_init = fused._affinity = fused._native_threads = None
+            for attr in ('type_out', '_reducer', '_shm_out', '_out_shape', '_out_dtype', '_memmap', 'out_path'):
+                setattr(fused, attr, getattr(last, attr))
+        return fused
+
+    def __call__(self, *args, **kwargs):
+        groups = [(self._fuse(group), group) for group in self._groups()]
+        stream = res = None
+        for idx, (fused, group) in enumerate(groups):
+            streamed = stream is not None and _streams_in(group[0])
+            if idx > 0:
+                if streamed:
+                    # consumes the outputs of the previous stage as they come
+                    fused._split_gen = True
+                    args, kwargs = (stream,), {}
+                else:
+                    args, kwargs = (res if stream is None else list(stream),), {}
+            if idx < len(groups) - 1 and _streams_out(group[-1]):
+                stream = fused.imap(*args, **kwargs)
+            elif streamed:
+                stream, res = None, fused._post_process(list(fused.imap(*args, **kwargs)))
+            else:
+                stream, res = None, fused(*args, **kwargs)
+        return res
@@ -0,0 +1,216 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+
+import atexit
+import importlib
+import multiprocessing
+import os
+
+
+# names of the execution backends
+BACKENDS: tuple = ('process', 'thread', 'serial', 'cluster', 'auto')
+
+# state of a running pool, as multiprocessing.pool.RUN, which is only imported with the first pool
+_RUN: str = 'RUN'
+
+# module-level pools shared by all B instances created with shared=True, keyed by backend and size
+_SHARED_POOLS: dict = {}
+
+
+class _SerialResult(object):
+    """
+    Outcome of a task run by a SerialPool, with the AsyncResult interface
+    """
+
+    def __init__(self, ok: bool, value):
+        self._ok = ok
+        self._value = value
+
+    def ready(self) -> bool:
+        return True
+
+    def successful(self) -> bool:
+        return self._ok
+
+    def wait(self, timeout: float or None = None) -> None:
+        pass
+
+    def get(self, timeout: float or None = None):
+        if not self._ok:
+            raise self._value
+        return self._value
+
+
+class SerialPool(object):
+    """
+    Pool look-alike which runs every task inline in the calling thread,
+    for debugging and for inputs too small to be worth a pool
+    """
+    _state: str = _RUN
+    _processes: int = 1
+
+    def map(self, fct, iterable, chunksize=None) -> list:
+        return [fct(item) for item in iterable]
+
+    def apply(self, fct, args=(), kwds={}):
+        return fct(*args, **kwds)
+
+    def apply_async(self, fct, args=(), kwds={}, callback=None, error_callback=None) -> _SerialResult:
+        try:
+            res = _SerialResult(True, fct(*args, **kwds))
+        except Exception as err:
+            res = _SerialResult(False, err)
+            if error_callback is not None:
+                error_callback(err)
+            return res
+        if callback is not None:
+            callback(res.get())
+        return res
+
+    def close(self) -> None:
+        pass
+
+    def terminate(self) -> None:
+        pass
+
+    def join(self) -> None:
+        pass
+
+
+def _preload(modules: tuple) -> None:
+    """
+    Pool initializer importing `modules` in each worker
+    """
+    for module in modules:
+        importlib.import_module(module)
+
+
+def new_pool(threads: int, backend: str = 'process', nodes: list or None = None, authkey: bytes or None = None,
+             start_method: str or None = None, preload: tuple = ()):
+    """
+    Creates a pool of `threads` workers for `backend` and records its
+    workers' pids. The 'cluster' backend connects to the worker servers
+    `nodes` instead, which bring their own workers. Processes are started
+    with `start_method`, the platform default if None, and import the
+    modules `preload` before their first task: once in the parent with
+    fork, once in the fork server with forkserver
+    """
+    if backend == 'serial':
+        return SerialPool()
+    elif backend == 'cluster':
+        from .cluster import ClusterPool
+        return ClusterPool(nodes, authkey)
+    elif backend == 'thread':
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(processes=threads)
+        # threads do not die on their own
+        pool._binge_pids = None
+        return pool
+    if os.name == 'posix':
+        # workers must share the parent's resource tracker, otherwise each of
+        # them would try to clean up the shared memory it attached on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+    ctx = multiprocessing.get_context(start_method)
+    preload = tuple(preload)
+    if preload and ctx.get_start_method() == 'fork':
+        # the workers inherit the modules of the parent
+        _preload(preload)
+    elif preload and ctx.get_start_method() == 'forkserver':
+        # only effective if the fork server is not running yet
+        ctx.set_forkserver_preload(list(preload))
+    pool = ctx.Pool(processes=threads, initializer=_preload if preload else None, initargs=(preload,))
+    pool._binge_pids = {proc.pid for proc in pool._pool}
+    return pool
+
+
+def pool_ok(pool) -> bool:
+    """
+    Checks that a pool is still running and that none of its workers died.
+    A worker killed while holding a task or a queue lock leaves the pool in an
+    unreliable state, so a pool whose workers changed since its creation is
+    considered broken, even though multiprocessing already respawned them
+    """
+    if pool is None or pool._state != _RUN:
+        return False
+    elif isinstance(pool, SerialPool) or pool._binge_pids is None:
+        return True
+    return {proc.pid for proc in pool._pool if proc.exitcode is None} == pool._binge_pids
+
+
+def terminate_pool(pool) -> None:
+    """
+    Terminates a pool, even if one of its dead workers still holds a lock
+    on the task or result queues
+    """
+    if pool._state == _RUN and hasattr(pool, '_inqueue'):
+        for lock in (getattr(pool._inqueue, '_rlock', None), getattr(pool._outqueue, '_wlock', None)):
+            if lock is None:
+                continue
+            # a lock is only released too many times if nobody was holding it
+            try:
+                lock.release()
+            except ValueError:
+                pass
+    pool.terminate()
+
+
+def shared_pool(threads: int or None = None, backend: str = 'process', start_method: str or None = None,
+                preload: tuple = ()):
+    """
+    Returns the module-level pool of `threads` workers for `backend`,
+    creating it on first use or re-creating it if it was closed or if one
+    of its workers died
+
+    Args:
+      * threads (int or None): the number of workers of the pool. None
+        means use all CPUs
+      * backend (str): 'process' or 'thread'
+      * start_method (str or None): how the processes are started, 'fork',
+        'spawn' or 'forkserver'. None means the platform default
+      * preload (tuple): the modules the processes import on startup
+    """
+    threads = multiprocessing.cpu_count() if threads is None else int(threads)
+    key = (backend, threads, start_method, tuple(preload))
+    pool = _SHARED_POOLS.get(key)
+    if not pool_ok(pool):
+        if pool is not None:
+            terminate_pool(pool)
+        pool = new_pool(threads, backend, start_method=start_method, preload=preload)
+        _SHARED_POOLS[key] = pool
+    return pool
+
+
+def close_shared_pools() -> None:
+    """
+    Closes and joins all module-level shared pools
+    """
+    while _SHARED_POOLS:
+        _, pool = _SHARED_POOLS.popitem()
+        pool.close()
+        pool.join()
+
+
+atexit.register(close_shared_pools)
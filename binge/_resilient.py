@@ -0,0 +1,149 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import itertools
+import queue
+import time
+from collections import deque
+
+
+class TaskError(Exception):
+    """
+    Stands for the output of an iteration which failed, with errors='return'
+
+    Attributes:
+      * error (Exception): the last exception raised by the iteration, or a
+        TimeoutError if it timed out
+      * attempts (int): how many times the iteration was run
+    """
+
+    def __init__(self, error: Exception, attempts: int):
+        super().__init__(error, attempts)
+        self.error: Exception = error
+        self.attempts: int = attempts
+
+    def __repr__(self) -> str:
+        return f"TaskError({self.error!r}, attempts={self.attempts:d})"
+
+
+def run_tasks(pool, wrap: Callable, tasks: list, workers: int, timeout: float or None = None, retries: int = 0,
+              speculative: bool = False, stop: bool = True) -> tuple:
+    """
+    Runs wrap on each of `tasks` on the pool, keeping at most one task per
+    free worker in flight so that each task is timed from when it starts.
+    A task which raises or runs longer than `timeout` seconds is given up
+    on and run again up to `retries` times. With speculative, workers left
+    idle once all tasks were sent run a second copy of the oldest running
+    tasks, the first copy to finish wins. With stop, returns as soon as a
+    task failed for good.
+
+    Returns the outcome of each task, (True, output) or (False, TaskError),
+    None for the tasks which were not run because of stop, and whether
+    some tasks which timed out may still be running on the pool
+    """
+    events = queue.Queue()
+    outcomes = [None] * len(tasks)
+    failures = [0] * len(tasks)
+    copies = [0] * len(tasks)
+    owner = {}
+    # copies of tasks which are running, by id, and copies which timed out
+    running = {}
+    abandoned = set()
+    pending = deque(range(len(tasks)))
+    ids = itertools.count()
+    remaining = len(tasks)
+
+    def submit(k):
+        cid = next(ids)
+        owner[cid] = k
+        running[cid] = time.monotonic()
+        copies[k] += 1
+        pool.apply_async(wrap, (tasks[k],), callback=lambda res: events.put((cid, True, res)),
+                         error_callback=lambda err: events.put((cid, False, err)))
+
+    def fail(k, err) -> bool:
+        # a copy of the task still running may succeed
+        if copies[k]:
+            return False
+        failures[k] += 1
+        if failures[k] <= retries:
+            pending.appendleft(k)
+            return False
+        outcomes[k] = (False, TaskError(err, failures[k]))
+        return True
+
+    while remaining:
+        # workers stuck on a task which timed out cannot take new ones
+        capacity = max(1, workers - len(abandoned))
+        while pending and len(running) < capacity:
+            k = pending.popleft()
+            # a copy which timed out may have finished in the meantime
+            if outcomes[k] is None:
+                submit(k)
+        if speculative and not pending and len(running) < capacity:
+            for cid in sorted(running, key=running.get):
+                if len(running) >= capacity:
+                    break
+                elif copies[owner[cid]] == 1:
+                    submit(owner[cid])
+        wait = None
+        if timeout is not None and running:
+            wait = max(0., min(running.values()) + timeout - time.monotonic())
+        try:
+            cid, ok, res = events.get(timeout=wait)
+        except queue.Empty:
+            now = time.monotonic()
+            for cid, started in list(running.items()):
+                if now - started >= timeout:
+                    k = owner[cid]
+                    del running[cid]
+                    abandoned.add(cid)
+                    copies[k] -= 1
+                    if outcomes[k] is None and fail(k, TimeoutError(f"task timed out after {timeout} s")):
+                        remaining -= 1
+                        if stop:
+                            return outcomes, True
+            continue
+        k = owner[cid]
+        late = cid in abandoned
+        abandoned.discard(cid)
+        if not late:
+            del running[cid]
+            copies[k] -= 1
+        if outcomes[k] is not None:
+            continue
+        elif ok:
+            # even a copy which timed out is welcome if it is the first to finish
+            outcomes[k] = (True, res)
+            remaining -= 1
+        elif not late and fail(k, res):
+            remaining -= 1
+            if stop:
+                return outcomes, bool(abandoned)
+    return outcomes, bool(abandoned)
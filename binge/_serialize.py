@@ -0,0 +1,343 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import pickle
+import threading
+import uuid
+from multiprocessing import shared_memory
+
+from ._shm import owned_view
+
+
+# buffers smaller than this are kept in the pickle stream by the 'pickle5' serializer, in bytes
+_OUT_OF_BAND_SIZE: int = 65536
+
+# tag of the output being dumped by a worker thread
+_TAG = threading.local()
+
+
+class Serializer(object):
+    """
+    How tasks and outputs are turned into what is sent between processes
+
+    Args:
+      * name (str): the name to pass B as serializer
+      * dumps (callable): turns an object into bytes, or into any small
+        picklable object
+      * loads (callable): turns the output of dumps, or a bytes-like
+        object with the same content, back into the object
+      * bytes_only (bool): whether dumps always outputs bytes which can
+        be loaded any number of times, which fct and the constant inputs
+        broadcast to all workers require
+      * discard (callable or None): frees the resources held by an output
+        of dumps which will never be loaded, e.g. because the call failed
+        or was stopped early. It is given the tag, see dump_tag, of the
+        outputs which never came back from the workers. None if there is
+        nothing to free
+
+    dumps, loads and discard must be picklable, e.g. module-level functions
+    """
+
+    def __init__(self, name: str, dumps: Callable, loads: Callable, bytes_only: bool = True,
+                 discard: Callable or None = None):
+        self.name: str = name
+        self.dumps: Callable = dumps
+        self.loads: Callable = loads
+        self.bytes_only: bool = bytes_only
+        self.discard: Callable or None = discard
+
+    def __repr__(self) -> str:
+        return f"Serializer('{self.name}')"
+
+
+def dump_tag() -> str or None:
+    """
+    Returns the tag of the output being dumped in a worker, unique to its
+    task and known to the caller, which a serializer can name what it
+    allocates after to discard it if the output never comes back. None
+    outside of the dumping of an output
+    """
+    return getattr(_TAG, 'value', None)
+
+
+def _pickle_dumps(obj) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _cloudpickle_dumps(obj) -> bytes:
+    # cloudpickle is only required if requested
+    import cloudpickle
+    return cloudpickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _Frame(object):
+    """
+    Pickle stream whose large buffers were moved to a shared memory
+    segment, to be loaded once
+    """
+
+    def __init__(self, main: bytes, name: str, bounds: list):
+        self.main: bytes = main
+        self.name: str = name
+        self.bounds: list = bounds
+
+
+def _pickle5_dumps(obj):
+    """
+    Pickles obj with protocol 5, and copies the large buffers it holds,
+    such as the data of ndarrays, once into a shared memory segment
+    """
+    buffers = []
+
+    def out_of_band(buf) -> bool:
+        if buf.raw().nbytes < _OUT_OF_BAND_SIZE:
+            # keep in-band
+            return True
+        buffers.append(buf)
+        return False
+
+    main = pickle.dumps(obj, protocol=5, buffer_callback=out_of_band)
+    if not buffers:
+        return main
+    bounds = [0]
+    for buf in buffers:
+        bounds.append(bounds[-1] + buf.raw().nbytes)
+    # named after the tag of the output, if any, so that the caller can free it if it never gets the output
+    shm = shared_memory.SharedMemory(name=dump_tag(), create=True, size=bounds[-1])
+    for buf, start, stop in zip(buffers, bounds[:-1], bounds[1:]):
+        shm.buf[start:stop] = buf.raw()
+    shm.close()
+    return _Frame(main, shm.name, bounds)
+
+
+def _pickle5_loads(data):
+    """
+    Loads the output of _pickle5_dumps. The loaded buffers are views on
+    the shared memory segment, which is unlinked and stays mapped for as
+    long as they are used
+    """
+    if not isinstance(data, _Frame):
+        return pickle.loads(data)
+    shm = shared_memory.SharedMemory(name=data.name)
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        # discarded by the sender meanwhile, the mapping is still valid
+        pass
+    buf = owned_view(shm)
+    return pickle.loads(data.main, buffers=[buf[start:stop] for start, stop in zip(data.bounds[:-1], data.bounds[1:])])
+
+
+def _pickle5_discard(data) -> None:
+    """
+    Unlinks the shared memory segment of an output of _pickle5_dumps, or
+    of the output dumped under a tag, which will not be loaded
+    """
+    if isinstance(data, _Frame):
+        data = data.name
+    elif not isinstance(data, str):
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=data)
+    except FileNotFoundError:
+        # already loaded
+        return
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# serializers by name
+_SERIALIZERS: dict = {
+    'pickle': Serializer('pickle', _pickle_dumps, pickle.loads),
+    'cloudpickle': Serializer('cloudpickle', _cloudpickle_dumps, pickle.loads),
+    'pickle5': Serializer('pickle5', _pickle5_dumps, _pickle5_loads, bytes_only=False, discard=_pickle5_discard),
+}
+
+
+def register_serializer(name: str, dumps: Callable, loads: Callable, bytes_only: bool = True,
+                        discard: Callable or None = None) -> Serializer:
+    """
+    Registers a serializer under `name`, for instance one which knows how
+    to send domain objects efficiently, for B to use with serializer=name.
+    See Serializer for the arguments. Registering must happen in the worker
+    processes too, e.g. at import, unless they are forked afterwards
+    """
+    _SERIALIZERS[name] = Serializer(name, dumps, loads, bytes_only, discard)
+    return _SERIALIZERS[name]
+
+
+def get_serializer(name: str) -> Serializer:
+    """
+    Returns the serializer registered under `name`
+    """
+    try:
+        return _SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"serializer '{name}' not understood")
+
+
+def _run_serialized(params):
+    """
+    Loads a task, runs it with wrap, and dumps its output under its tag
+    """
+    serializer, wrap, data, tag = params
+    res = wrap(serializer.loads(data))
+    _TAG.value = tag
+    try:
+        return serializer.dumps(res)
+    finally:
+        _TAG.value = None
+
+
+class SerializingPool(object):
+    """
+    Pool look-alike which sends the tasks to the workers of `pool` and
+    gets their outputs back through `serializer`. The tasks which were
+    not run and the outputs which were not loaded when the call ends are
+    discarded by release
+    """
+
+    def __init__(self, pool, serializer: Serializer):
+        self.pool = pool
+        self.serializer: Serializer = serializer
+        # results holding data to discard if never loaded
+        self._results: set = set()
+        self._lock = threading.Lock()
+        self._released: bool = False
+
+    def map(self, fct, iterable, chunksize=None) -> list:
+        # one task per item, so that each can be discarded on its own
+        return [res.get() for res in [self.apply_async(fct, (item,)) for item in iterable]]
+
+    def apply(self, fct, args=(), kwds={}):
+        return self.apply_async(fct, args, kwds).get()
+
+    def apply_async(self, fct, args=(), kwds={}, callback=None, error_callback=None):
+        # binge tasks take a single argument
+        data = self.serializer.dumps(args[0])
+        tag = None
+        if self.serializer.discard is not None:
+            tag = f"bng_{uuid.uuid4().hex[:16]}"
+        res = _SerializedResult(self, data, tag, callback, error_callback)
+        if tag is not None:
+            with self._lock:
+                self._results.add(res)
+        res.result = self.pool.apply_async(_run_serialized, ((self.serializer, fct, data, tag),),
+                                           callback=res.loaded_callback, error_callback=res.failed_callback)
+        return res
+
+    def _settle(self, res: _SerializedResult, data) -> bool:
+        """
+        Replaces the data held by `res` with `data`, once its task is
+        done, and returns False if the pool was released meanwhile, in
+        which case `data` is discarded
+        """
+        if self.serializer.discard is None:
+            return True
+        with self._lock:
+            res.data = data
+            res.tag = None
+            if data is None:
+                self._results.discard(res)
+            if not self._released:
+                return True
+        if data is not None:
+            self.serializer.discard(data)
+        return False
+
+    def release(self) -> None:
+        """
+        Discards the tasks which were not run and the outputs which were
+        not loaded, or which never came back, e.g. from a terminated pool.
+        Late outputs are discarded when they come
+        """
+        if self.serializer.discard is None:
+            return
+        with self._lock:
+            self._released = True
+            leftovers = [res.data for res in self._results if res.data is not None]
+            leftovers += [res.tag for res in self._results if res.tag is not None]
+            self._results.clear()
+        for data in leftovers:
+            self.serializer.discard(data)
+
+
+class _SerializedResult(object):
+    """
+    AsyncResult of a SerializingPool task, which loads the output. `data`
+    is the task until it ran, then its output until loaded, and `tag`
+    that of its output until it came back
+    """
+
+    def __init__(self, owner: SerializingPool, data, tag: str or None, callback: Callable or None,
+                 error_callback: Callable or None):
+        self.owner: SerializingPool = owner
+        self.data = data
+        self.tag: str or None = tag
+        self.callback: Callable or None = callback
+        self.error_callback: Callable or None = error_callback
+        self.result = None
+        self._loaded: list = []
+
+    def _load(self, data):
+        if not self._loaded:
+            self._loaded.append(self.owner.serializer.loads(data))
+            self.owner._settle(self, None)
+        return self._loaded[0]
+
+    def loaded_callback(self, data) -> None:
+        # the task was consumed by the worker
+        if not self.owner._settle(self, data):
+            return
+        if self.callback is not None:
+            self.callback(self._load(data))
+
+    def failed_callback(self, err) -> None:
+        # the task may not have reached a worker
+        task = self.data
+        self.owner._settle(self, None)
+        if task is not None and self.owner.serializer.discard is not None:
+            self.owner.serializer.discard(task)
+        if self.error_callback is not None:
+            self.error_callback(err)
+
+    def ready(self) -> bool:
+        return self.result.ready()
+
+    def successful(self) -> bool:
+        return self.result.successful()
+
+    def wait(self, timeout: float or None = None) -> None:
+        self.result.wait(timeout)
+
+    def get(self, timeout: float or None = None):
+        return self._load(self.result.get(timeout))
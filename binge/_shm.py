@@ -0,0 +1,250 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable, List
+
+import ctypes
+import functools
+from multiprocessing import shared_memory
+
+
+# worker-side views on the segments attached by the running task, by name
+_ATTACHED: dict = {}
+
+
+def owned_view(shm: shared_memory.SharedMemory) -> memoryview:
+    """
+    Returns a writable memoryview on the whole segment `shm`, which takes
+    over the mapping: `shm` is closed once the view, and all the slices
+    and arrays taken from it, are garbage collected
+    """
+    ref = ctypes.c_char.from_buffer(shm.buf)
+    address = ctypes.addressof(ref)
+    # shm.buf must not stay exported for shm to be closed
+    del ref
+    holder = _mapped_type(shm.size).from_address(address)
+    holder.shm = shm
+    return memoryview(holder)
+
+
+@functools.lru_cache(maxsize=64)
+def _mapped_type(size: int) -> type:
+    return type('_Mapped', (ctypes.c_ubyte * size,), {'__del__': _close_mapped})
+
+
+def _close_mapped(holder) -> None:
+    holder.shm.close()
+
+
+def _attach(name: str) -> memoryview:
+    """
+    Returns a view on the shared memory segment `name`, attaching it on
+    first use in the task. The worker detaches it once the task ended, see
+    end_task, and the arrays taken from it are garbage collected
+    """
+    buf = _ATTACHED.get(name)
+    if buf is None:
+        buf = _ATTACHED[name] = owned_view(shared_memory.SharedMemory(name=name))
+    return buf
+
+
+def _end_task(fct) -> None:
+    end_task = getattr(fct, 'end_task', None)
+    if end_task is not None:
+        end_task()
+
+
+class _ShmItem(object):
+    """
+    Reference to the j-th element, or to the j slice, along the first
+    dimension of an ndarray stored in shared memory
+    """
+    __slots__ = ('name', 'shape', 'dtype', 'j')
+
+    def __init__(self, name: str, shape: tuple, dtype: str, j: int or slice):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.j = j
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype, self.j
+
+    def __setstate__(self, state):
+        self.name, self.shape, self.dtype, self.j = state
+
+    def view(self):
+        """
+        Returns a read-only view on the referenced element, without copy
+        """
+        from numpy import ndarray
+        arr = ndarray(self.shape, dtype=self.dtype, buffer=_attach(self.name))[self.j]
+        if isinstance(arr, ndarray):
+            arr.flags.writeable = False
+        return arr
+
+
+class ShmSplit(object):
+    """
+    Copies an ndarray once into a shared memory segment, and behaves as
+    a sequence of references to its elements along the first dimension,
+    or to its blocks delimited by `bounds`
+    """
+
+    def __init__(self, arr, bounds: list or None = None):
+        from numpy import ndarray
+        self.bounds: list or None = bounds
+        self.shape: tuple = arr.shape
+        self.dtype: str = arr.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+        ndarray(arr.shape, dtype=arr.dtype, buffer=self.shm.buf)[...] = arr
+
+    def __len__(self) -> int:
+        return self.shape[0] if self.bounds is None else len(self.bounds) - 1
+
+    def __getitem__(self, j: int) -> _ShmItem:
+        if self.bounds is not None:
+            j = slice(self.bounds[j], self.bounds[j + 1])
+        return _ShmItem(self.shm.name, self.shape, self.dtype, j)
+
+    def release(self) -> None:
+        """
+        Frees the shared memory segment
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+def shareable(arr) -> bool:
+    """
+    Checks whether an ndarray can be stored in shared memory
+    """
+    return arr.nbytes > 0 and not arr.dtype.hasobject
+
+
+class ShmCall(object):
+    """
+    Callable which resolves the shared memory references of its
+    arguments into ndarray views before calling fct
+    """
+
+    def __init__(self, fct: Callable):
+        self.fct: Callable = fct
+
+    def __call__(self, *args, **kwargs):
+        args = [arg.view() if isinstance(arg, _ShmItem) else arg for arg in args]
+        for key, value in kwargs.items():
+            if isinstance(value, _ShmItem):
+                kwargs[key] = value.view()
+        return self.fct(*args, **kwargs)
+
+    def end_task(self) -> None:
+        """
+        Detaches the segments attached by the task
+        """
+        _ATTACHED.clear()
+        _end_task(self.fct)
+
+
+class ShmOutput(object):
+    """
+    Output ndarray of shape (n,) + shape preallocated in shared memory.
+    The missing shape or dtype are taken from the output `first` of the
+    first iteration
+    """
+
+    def __init__(self, n: int, first=None, shape: tuple or None = None, dtype: str or None = None):
+        from numpy import asarray, dtype as np_dtype, ndarray
+        if first is not None:
+            first = asarray(first)
+            shape = first.shape if shape is None else shape
+            dtype = first.dtype if dtype is None else dtype
+        self.shape: tuple = (int(n),) + tuple(shape)
+        self.dtype: str = np_dtype(dtype).str
+        size = np_dtype(dtype).itemsize
+        for dim in self.shape:
+            size *= int(dim)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.array = ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def result(self, stack: bool = False):
+        """
+        Returns the output ndarray, stacked along its first dimension
+        if `stack`, and frees the shared memory segment name. The
+        returned array owns the segment through its base, which closes
+        it once garbage collected
+        """
+        from numpy import ndarray
+        self.array = None
+        self.shm.unlink()
+        arr = ndarray(self.shape, dtype=self.dtype, buffer=owned_view(self.shm))
+        if stack and arr.ndim > 1:
+            return arr.reshape((-1,) + arr.shape[2:])
+        return arr
+
+    def release(self) -> None:
+        """
+        Frees the shared memory segment
+        """
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmWrite(object):
+    """
+    Callable which writes the output of fct into its slot of a
+    preallocated shared memory output, instead of returning it
+    """
+    # the slot is given by the iteration index
+    needs_index: bool = True
+
+    def __init__(self, fct: Callable, out: ShmOutput):
+        self.fct: Callable = fct
+        self.name: str = out.shm.name
+        self.shape: tuple = out.shape
+        self.dtype: str = out.dtype
+
+    def __call__(self, *args, _binge_index: int, **kwargs):
+        from numpy import ndarray
+        res = self.fct(*args, **kwargs)
+        ndarray(self.shape, dtype=self.dtype, buffer=_attach(self.name))[_binge_index] = res
+
+    def end_task(self) -> None:
+        """
+        Detaches the output segment
+        """
+        _ATTACHED.pop(self.name, None)
+        _end_task(self.fct)
+
+
+def release_all(splits: List[ShmSplit]) -> None:
+    """
+    Frees the shared memory segments of all `splits`
+    """
+    for split in splits:
+        split.release()
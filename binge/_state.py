@@ -0,0 +1,82 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+
+# worker-side states, by key of the B instance they belong to, one set per thread
+_LOCAL = threading.local()
+# how many states a worker keeps before dropping the least recently used
+_MAX_STATES: int = 16
+_KEYS = itertools.count()
+
+
+def new_key() -> tuple:
+    """
+    Returns a key which identifies states across the processes sharing a pool
+    """
+    return os.getpid(), next(_KEYS)
+
+
+def worker_state(key: tuple, worker_init: Callable) -> dict:
+    """
+    Returns the state of `key` in the current worker, creating it with
+    `worker_init` on first use
+    """
+    states = getattr(_LOCAL, 'states', None)
+    if states is None:
+        states = _LOCAL.states = OrderedDict()
+    state = states.get(key)
+    if state is None:
+        state = {}
+        worker_init(state)
+        states[key] = state
+        if len(states) > _MAX_STATES:
+            states.popitem(last=False)
+    else:
+        states.move_to_end(key)
+    return state
+
+
+class StateCall(object):
+    """
+    Callable which passes fct the worker-local state under parameter
+    name '_state', initializing it once per worker with worker_init
+    """
+
+    def __init__(self, fct: Callable, worker_init: Callable, key: tuple):
+        self.fct: Callable = fct
+        self.worker_init: Callable = worker_init
+        self.key: tuple = key
+
+    def __call__(self, *args, **kwargs):
+        return self.fct(*args, _state=worker_state(self.key, self.worker_init), **kwargs)
@@ -0,0 +1,192 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable, List
+
+import json
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _size(obj) -> int:
+    """
+    Returns the size of obj once pickled, or -1 if it cannot be pickled
+    """
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return -1
+
+
+class Profiled(object):
+    """
+    Callable which times fct and measures the size of its inputs and
+    output, and returns the output along with this task record
+    """
+    # the record holds the iteration index
+    needs_index: bool = True
+
+    def __init__(self, fct: Callable, on_task_start: Callable or None = None,
+                 on_task_end: Callable or None = None):
+        self.fct: Callable = fct
+        self.on_task_start: Callable or None = on_task_start
+        self.on_task_end: Callable or None = on_task_end
+
+    def __call__(self, *args, _binge_index: int, **kwargs):
+        record = {'index': _binge_index, 'pid': os.getpid(), 'thread': threading.get_ident(), 'start': time.time()}
+        if self.on_task_start is not None:
+            self.on_task_start(dict(record))
+        cpu = time.thread_time()
+        t = time.perf_counter()
+        if getattr(self.fct, 'needs_index', False):
+            res = self.fct(*args, _binge_index=_binge_index, **kwargs)
+        else:
+            res = self.fct(*args, **kwargs)
+        record['wall'] = time.perf_counter() - t
+        record['cpu'] = time.thread_time() - cpu
+        record['end'] = time.time()
+        record['bytes_in'] = _size((args, kwargs))
+        record['bytes_out'] = _size(res)
+        if self.on_task_end is not None:
+            self.on_task_end(dict(record))
+        return res, record
+
+    def end_task(self) -> None:
+        end_task = getattr(self.fct, 'end_task', None)
+        if end_task is not None:
+            end_task()
+
+
+class Stats(object):
+    """
+    Execution statistics of a binged call: phase timings in the parent,
+    one record per iteration run by the workers, and per worker totals
+
+    Attributes:
+      * phases (dict): duration in seconds of each phase of the call:
+        prepare, cache, backend, share, pool, run, post_process and total
+      * tasks (list of dict): one record per iteration with its index,
+        the pid and thread of the worker, its start and end timestamps,
+        its wall and CPU times in seconds, the time it waited in queue
+        since the dispatch, and the pickled sizes of its inputs and output
+    """
+
+    def __init__(self):
+        self.phases: dict = {}
+        self.tasks: List[dict] = []
+        self._dispatched: float or None = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager adding the time spent within to phase `name`
+        """
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - t
+
+    def dispatch(self) -> None:
+        """
+        Records the time at which tasks are sent to the workers
+        """
+        self._dispatched = time.time()
+
+    def collect(self, mapped_pool: list) -> list:
+        """
+        Splits the outputs of Profiled tasks into the outputs, which are
+        returned, and the task records, which are kept. The outputs folded
+        with reduce come with the list of records of their iterations
+        """
+        for _, records in mapped_pool:
+            for record in (records if isinstance(records, list) else [records]):
+                record['queued'] = max(0., record['start'] - self._dispatched)
+                self.tasks.append(record)
+        return [res for res, _ in mapped_pool]
+
+    @property
+    def workers(self) -> dict:
+        """
+        Number of iterations, busy and idle times in seconds, by worker
+        "pid:thread". Idle time is counted over the run phase
+        """
+        run = self.phases.get('run', 0.)
+        workers = {}
+        for record in self.tasks:
+            worker = workers.setdefault(f"{record['pid']}:{record['thread']}", {'tasks': 0, 'busy': 0.})
+            worker['tasks'] += 1
+            worker['busy'] += record['wall']
+        for worker in workers.values():
+            worker['idle'] = max(0., run - worker['busy'])
+        return workers
+
+    @property
+    def bytes_in(self) -> int:
+        """
+        Total pickled size of the iterations inputs
+        """
+        return sum(record['bytes_in'] for record in self.tasks)
+
+    @property
+    def bytes_out(self) -> int:
+        """
+        Total pickled size of the iterations outputs
+        """
+        return sum(record['bytes_out'] for record in self.tasks)
+
+    def stragglers(self, factor: float = 3.) -> List[dict]:
+        """
+        Returns the records of the iterations which took more than
+        `factor` times the median wall time
+        """
+        if not self.tasks:
+            return []
+        median = sorted(record['wall'] for record in self.tasks)[len(self.tasks) // 2]
+        return [record for record in self.tasks if record['wall'] > factor * median]
+
+    def to_dict(self) -> dict:
+        return {'phases': dict(self.phases), 'tasks': list(self.tasks), 'workers': self.workers,
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+    def to_json(self, path: str or None = None) -> str:
+        """
+        Returns the statistics as JSON, also written to `path` if given
+        """
+        txt = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(txt)
+        return txt
+
+    def __repr__(self):
+        phases = ', '.join(f"{name}={value:.4f}s" for name, value in self.phases.items())
+        return (f"Stats of {len(self.tasks)} iterations over {len(self.workers)} workers: {phases}, "
+                f"{self.bytes_in} bytes in, {self.bytes_out} bytes out")
@@ -0,0 +1,615 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from binge import B, close_shared_pools, __version__
+
+
+################################################################################
+# per-call latency of small maps, with and without a warm pool
+
+# a binged call normally opens its own pool of processes and tears it
+# down when done. For small maps, spawning the processes costs much more
+# than the work itself, which a warm pool avoids
+
+def dum(a):
+    return a + 1
+
+
+def bench_warm_pool(n_calls=50, size=8, threads=4):
+    """
+    Returns the mean per-call latency in seconds of a binged call over
+    `size` items, for a cold pool, a pool started with `B.start()` and the
+    module-level shared pool
+    """
+    li = list(range(size))
+    res = {}
+
+    bf = B(dum, threads=threads)
+    t = time.perf_counter()
+    for _ in range(n_calls):
+        bf(li)
+    res['cold'] = (time.perf_counter() - t) / n_calls
+
+    with B(dum, threads=threads) as bf:
+        # first call is paid once, not per call
+        bf(li)
+        t = time.perf_counter()
+        for _ in range(n_calls):
+            bf(li)
+        res['warm'] = (time.perf_counter() - t) / n_calls
+
+    bf = B(dum, threads=threads, shared=True)
+    bf(li)
+    t = time.perf_counter()
+    for _ in range(n_calls):
+        bf(li)
+    res['shared'] = (time.perf_counter() - t) / n_calls
+    close_shared_pools()
+    return res
+
+
+################################################################################
+# dispatch overhead of cheap iterations, with and without chunking
+
+def bench_chunksize(n=100000, threads=4):
+    """
+    Returns the duration in seconds of a binged call over `n` cheap
+    iterations, for one task per iteration, fixed and automatic chunk sizes
+    """
+    li = list(range(n))
+    res = {}
+    with B(dum, threads=threads) as bf:
+        bf(li[:threads])
+        for chunksize in (None, 1000, 'auto'):
+            bf.chunksize = chunksize
+            t = time.perf_counter()
+            bf(li)
+            res[str(chunksize)] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# distributing a large ndarray, with and without shared memory
+
+def bench_shm_in(shape=(16, 2000, 2000), threads=4):
+    """
+    Returns the duration in seconds of a binged np.sum over the first
+    dimension of an array of `shape`, with pickled slices and with
+    shared memory views
+    """
+    import numpy as np
+    data = np.random.uniform(size=shape)
+    res = {}
+    for shm_in in (False, True):
+        with B(np.sum, threads=threads, type_in='nda', shm_in=shm_in) as bf:
+            bf(data[:threads])
+            t = time.perf_counter()
+            bf(data)
+            res['shm' if shm_in else 'pickle'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# gathering large outputs, with and without a preallocated shared output
+
+def big_row(i, size=1000000):
+    import numpy as np
+    return np.full(size, i, dtype=float)
+
+
+def bench_shm_out(n=64, threads=4):
+    """
+    Returns the duration in seconds of a binged call with `n` outputs of
+    8 MB each gathered with type_out='nda', with and without shm_out, and
+    written to a file with type_out='memmap'
+    """
+    res = {}
+    for shm_out in (False, True):
+        with B(big_row, threads=threads, type_out='nda', shm_out=shm_out) as bf:
+            bf(range(threads))
+            t = time.perf_counter()
+            bf(range(n))
+            res['shm' if shm_out else 'concatenate'] = time.perf_counter() - t
+    path = os.path.join(tempfile.mkdtemp(), 'out.npy')
+    with B(big_row, threads=threads, type_out=path) as bf:
+        bf(range(threads))
+        t = time.perf_counter()
+        bf(range(n))
+        res['memmap'] = time.perf_counter() - t
+    os.remove(path)
+    return res
+
+
+################################################################################
+# per-task overhead against the number of iterations
+
+def bench_overhead(ns=(10, 100, 1000, 10000), threads=4):
+    """
+    Returns the time per iteration in seconds of a binged call on a warm
+    pool, for a no-op fct and `ns` iterations
+    """
+    res = {}
+    with B(dum, threads=threads) as bf:
+        bf(range(threads))
+        for n in ns:
+            t = time.perf_counter()
+            bf(range(n))
+            res[str(n)] = (time.perf_counter() - t) / n
+    return res
+
+
+################################################################################
+# strong and weak scaling against the number of workers
+
+def spin(a, loops=200000):
+    """
+    CPU-bound fct holding the GIL
+    """
+    for _ in range(loops):
+        a += 1
+    return a
+
+
+def bench_strong_scaling(n=32, threads=(1, 2, 4)):
+    """
+    Returns the duration in seconds of `n` CPU-bound iterations, for each
+    number of workers in `threads`
+    """
+    res = {}
+    for nt in threads:
+        with B(spin, threads=nt) as bf:
+            bf(range(nt))
+            t = time.perf_counter()
+            bf(range(n))
+            res[str(nt)] = time.perf_counter() - t
+    return res
+
+
+def bench_weak_scaling(per_worker=8, threads=(1, 2, 4)):
+    """
+    Returns the duration in seconds of `per_worker` CPU-bound iterations
+    per worker, for each number of workers in `threads`
+    """
+    res = {}
+    for nt in threads:
+        with B(spin, threads=nt) as bf:
+            bf(range(nt))
+            t = time.perf_counter()
+            bf(range(per_worker * nt))
+            res[str(nt)] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# throughput against the argument and output payload size
+
+def identity(a):
+    return a
+
+
+def _payloads(sizes):
+    import numpy as np
+    import pandas as pd
+    yield 'scalar', 1.
+    for size in sizes:
+        yield f'nda_{size}', np.ones(size)
+        yield f'df_{size}', pd.DataFrame({'a': np.ones(size), 'b': np.arange(size)})
+
+
+def bench_payload(n=64, sizes=(1000, 100000), threads=4):
+    """
+    Returns the duration in seconds of `n` iterations sending and
+    returning a payload, for scalars, ndarrays and DataFrames of `sizes`
+    """
+    res = {}
+    with B(identity, threads=threads) as bf:
+        bf(range(threads))
+        for name, payload in _payloads(sizes):
+            t = time.perf_counter()
+            bf([payload] * n)
+            res[name] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# cost of the type_in and type_out conversions
+
+def bench_conversion(n=10000):
+    """
+    Returns the duration in seconds of `n` iterations for each type_in and
+    type_out conversion, on the serial backend to leave the pool out
+    """
+    import numpy as np
+    import pandas as pd
+    res = {}
+    inputs = {'nda': np.ones((n, 4)), 'str': 'a' * n, 'gen': (i for i in range(n)),
+              'df': pd.DataFrame({'a': np.ones(n)}), 'series': pd.Series(np.ones(n))}
+    for type_in, item in inputs.items():
+        t = time.perf_counter()
+        B(identity, type_in=type_in, backend='serial')(item)
+        res[f'in_{type_in}'] = time.perf_counter() - t
+    outputs = {'nd1': (np.ones((n, 4)), 'nda'), 'nda': (np.ones((n, 4)), 'nda'),
+               'df': ([pd.DataFrame({'a': [1.]})] * n, None)}
+    for type_out, (item, type_in) in outputs.items():
+        t = time.perf_counter()
+        B(identity, type_in=type_in, type_out=type_out, backend='serial')(item)
+        res[f'out_{type_out}'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# sending a large constant input along with every task or once per worker
+
+def lookup(a, table):
+    return table[a]
+
+
+def bench_broadcast(n=256, size=2000000, threads=4):
+    """
+    Returns the duration in seconds of `n` iterations looking up a table
+    of `size` floats, with and without broadcast
+    """
+    import numpy as np
+    table = np.ones(size)
+    res = {}
+    for broadcast in (False, True):
+        with B(lookup, threads=threads, broadcast=broadcast) as bf:
+            bf(range(threads), table)
+            t = time.perf_counter()
+            bf(range(n), table)
+            res['broadcast' if broadcast else 'per_task'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# preparing and dispatching a huge number of iterations
+
+# with the fork start method, a call opening its own pool leaves its inputs
+# for the workers to inherit and only sends them ranges of indices, instead
+# of building and pickling one task per chunk of iterations
+
+def bench_huge_n(n=1000000, threads=4):
+    """
+    Returns the duration in seconds of a binged call over `n` cheap
+    iterations with inherited inputs, and with chunks of the same size
+    sent along with the tasks
+    """
+    li = list(range(n))
+    chunksize = -(-n // (threads * 4))
+    res = {}
+    for inherit in (False, True):
+        t = time.perf_counter()
+        B(dum, threads=threads, chunksize=chunksize, inherit=inherit)(li)
+        res['inherited' if inherit else 'pickled'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# summing the outputs in the parent or folding them in the workers
+
+def histogram(a, bins=1000):
+    import numpy as np
+    return np.bincount(np.arange(bins) % (a + 1), minlength=bins)
+
+
+def bench_reduce(n=20000, threads=4):
+    """
+    Returns the duration in seconds of summing `n` histograms output by
+    the iterations, gathered in the parent and with reduce
+    """
+    res = {}
+    t = time.perf_counter()
+    sum(B(histogram, threads=threads)(range(n)))
+    res['gathered'] = time.perf_counter() - t
+    t = time.perf_counter()
+    B(histogram, threads=threads, reduce='sum')(range(n))
+    res['reduce'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# sweeping a grid of parameters, built beforehand or computed lazily
+
+def add(a, b):
+    return a + b
+
+
+def bench_product(shape=(1000, 1000), threads=4):
+    """
+    Returns the duration in seconds of a binged call over a grid of
+    `shape` points, zipping the materialized product of the axes and with
+    product=True
+    """
+    import itertools
+    axes = [range(size) for size in shape]
+    res = {}
+    t = time.perf_counter()
+    a, b = zip(*itertools.product(*axes))
+    B(add, threads=threads, type_out='nda')(a, b)
+    res['materialized'] = time.perf_counter() - t
+    t = time.perf_counter()
+    B(add, threads=threads, product=True)(*axes)
+    res['product'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# tail latency of a call with one hung iteration
+
+def nap(a, hung=0, duration=2.):
+    time.sleep(duration if a == hung else 0.01)
+    return a
+
+
+def bench_stragglers(n=32, duration=2., threads=4):
+    """
+    Returns the duration in seconds of `n` short iterations one of which
+    hangs for `duration` seconds, waiting for it and with a timeout
+    returning partial results
+    """
+    res = {}
+    t = time.perf_counter()
+    B(nap, threads=threads)(range(n), duration=duration)
+    res['wait'] = time.perf_counter() - t
+    t = time.perf_counter()
+    B(nap, threads=threads, timeout=duration / 10, errors='return')(range(n), duration=duration)
+    res['timeout'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# sending large ndarrays with each serializer
+
+def bench_serializer(n=32, size=1000000, threads=4):
+    """
+    Returns the duration in seconds of `n` iterations sending and
+    returning an ndarray of `size` floats, for the default pickling and
+    each built-in serializer
+    """
+    import numpy as np
+    li = [np.ones(size) for _ in range(n)]
+    res = {}
+    for serializer in (None, 'pickle', 'pickle5', 'cloudpickle'):
+        try:
+            with B(identity, threads=threads, serializer=serializer) as bf:
+                bf(li[:threads])
+                t = time.perf_counter()
+                bf(li)
+                res[str(serializer)] = time.perf_counter() - t
+        except ImportError:
+            # cloudpickle is optional
+            pass
+    return res
+
+
+################################################################################
+# overhead of sending the tasks to worker servers over TCP
+
+def bench_cluster(n=64, nodes=2, threads=2):
+    """
+    Returns the duration in seconds of `n` CPU-bound iterations on local
+    processes and on `nodes` local worker servers of `threads` workers
+    each, which measures the overhead of the cluster protocol
+    """
+    from .cluster import serve
+    ready = multiprocessing.Queue()
+    servers = [multiprocessing.Process(target=serve, args=(('127.0.0.1', 0), threads), kwargs={'ready': ready})
+               for _ in range(nodes)]
+    for server in servers:
+        server.start()
+    res = {}
+    try:
+        addresses = [ready.get(timeout=30) for _ in servers]
+        for backend in ('process', 'cluster'):
+            with B(spin, threads=nodes * threads, backend=backend, nodes=addresses) as bf:
+                bf(range(nodes * threads))
+                t = time.perf_counter()
+                bf(range(n))
+                res[backend] = time.perf_counter() - t
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+    return res
+
+
+################################################################################
+# BLAS-bound iterations, with the native thread pools capped and the workers pinned
+
+def matmul(a, size=300):
+    """
+    fct running on the native BLAS thread pool
+    """
+    import numpy as np
+    m = np.full((size, size), a / size)
+    return float((m @ m).sum())
+
+
+def bench_native_threads(n=64, threads=None):
+    """
+    Returns the duration in seconds of `n` BLAS-bound iterations on
+    `threads` processes, with the native thread pools left as they are,
+    capped, and capped with the workers pinned
+    """
+    threads = multiprocessing.cpu_count() if threads is None else threads
+    res = {}
+    for case, kwargs in (('default', {}), ('capped', {'native_threads': 'auto'}),
+                         ('pinned', {'native_threads': 'auto', 'affinity': True})):
+        with B(matmul, threads=threads, backend='process', **kwargs) as bf:
+            bf(range(threads))
+            t = time.perf_counter()
+            bf(range(n))
+            res[case] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# import time and first call startup, for each start method and with preloading
+
+def np_total(a):
+    """
+    fct importing numpy on its first call
+    """
+    import numpy as np
+    return float(np.arange(a + 1).sum())
+
+
+def bench_startup(threads=4, preload=('numpy',)):
+    """
+    Returns the duration in seconds of `import binge` and, for each start
+    method with and without `preload`, of a first call on `threads` new
+    processes, each measured in a fresh interpreter
+    """
+    def run(code):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        return float(out.stdout.split()[-1])
+
+    res = {'import': run("import time; t = time.perf_counter(); import binge; print(time.perf_counter() - t)")}
+    for start_method in multiprocessing.get_all_start_methods():
+        for case, modules in (('', ()), ('_preload', preload)):
+            res[start_method + case] = run(
+                "import time\n"
+                "from binge import B\n"
+                "from binge.benchmark import np_total\n"
+                "if __name__ == '__main__':\n"
+                "    t = time.perf_counter()\n"
+                f"    B(np_total, threads={threads}, start_method={start_method!r}, preload={list(modules)!r})"
+                f"(range({threads}))\n"
+                "    print(time.perf_counter() - t)\n")
+    return res
+
+
+################################################################################
+# chaining element-wise stages, one call after the other or fused in a pipeline
+
+def scale(a):
+    return a * 2.
+
+
+def bench_pipeline(n=64, size=100000, threads=4):
+    """
+    Returns the duration in seconds of three element-wise stages over `n`
+    ndarrays of `size` floats, called one after the other and as a fused
+    pipeline
+    """
+    from ._pipeline import Pipeline
+    import numpy as np
+    li = [np.ones(size) for _ in range(n)]
+    res = {}
+    t = time.perf_counter()
+    B(scale, threads=threads)(B(scale, threads=threads)(B(scale, threads=threads)(li)))
+    res['chained'] = time.perf_counter() - t
+    t = time.perf_counter()
+    Pipeline(*[B(scale, threads=threads)] * 3)(li)
+    res['pipeline'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# looking for a hit, with a full call or stopping at the first one
+
+def is_hit(a, hit=8):
+    time.sleep(0.01)
+    return a == hit
+
+
+def bench_search(n=512, threads=4):
+    """
+    Returns the duration in seconds of looking for a hit among the first
+    of `n` iterations of 10 ms, with a full call and with any
+    """
+    res = {}
+    with B(is_hit, threads=threads) as bf:
+        bf(range(threads))
+        t = time.perf_counter()
+        any(bf(range(n)))
+        res['call'] = time.perf_counter() - t
+        t = time.perf_counter()
+        bf.any(range(n))
+        res['any'] = time.perf_counter() - t
+    return res
+
+
+################################################################################
+# running the suite and comparing versions
+
+SUITE: dict = {
+    'warm_pool': bench_warm_pool,
+    'chunksize': bench_chunksize,
+    'shm_in': bench_shm_in,
+    'shm_out': bench_shm_out,
+    'overhead': bench_overhead,
+    'strong_scaling': bench_strong_scaling,
+    'weak_scaling': bench_weak_scaling,
+    'payload': bench_payload,
+    'conversion': bench_conversion,
+    'broadcast': bench_broadcast,
+    'huge_n': bench_huge_n,
+    'reduce': bench_reduce,
+    'product': bench_product,
+    'stragglers': bench_stragglers,
+    'serializer': bench_serializer,
+    'cluster': bench_cluster,
+    'native_threads': bench_native_threads,
+    'startup': bench_startup,
+    'pipeline': bench_pipeline,
+    'search': bench_search,
+}
+
+
+def run_suite(names=None):
+    """
+    Runs the benchmarks `names`, or all of them, and returns their results
+    along with the machine and version information
+    """
+    results = {'version': __version__,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': multiprocessing.cpu_count(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'results': {}}
+    for name in (SUITE if names is None else names):
+        print(f"Running {name}", file=sys.stderr)
+        results['results'][name] = SUITE[name]()
+    close_shared_pools()
+    return results
+
+
+def compare(old, new, tolerance=0.2):
+    """
+    Returns the lines of a comparison of two suite results, flagging the
+    timings more than `tolerance` slower in `new`
+    """
+    lines = [f"{'benchmark':>32s} {old['version']:>10s} {new['version']:>10s}  ratio"]
+    for name, cases in new['results'].items():
+        for case, value in cases.items():
+            before = old['results'].get(name, {}).get(case)
+            if before is None:
+                continue
+            ratio = value / before if before > 0 else float('inf')
+            flag = '  SLOWER' if ratio > 1 + tolerance else ''
+            lines.append(f"{name + '/' + case:>32s} {before:10.4g} {value:10.4g} {ratio:6.2f}{flag}")
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="binge benchmark suite")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run among {', '.join(SUITE)}, default all")
+    parser.add_argument('--out', help="JSON file to save the results to")
+    parser.add_argument('--compare', help="JSON file of previous results to compare to")
+    opts = parser.parse_args()
+    results = run_suite(opts.names or None)
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if opts.compare:
+        with open(opts.compare) as f:
+            print('\n'.join(compare(json.load(f), results)))
+    else:
+        print(json.dumps(results, indent=2))
@@ -27,10 +27,24 @@ import typing
 if typing.TYPE_CHECKING:
     from typing import Callable, Set
 
+import functools
+import itertools
+import math
 import multiprocessing
+import operator
+import os
+import pickle
+import queue
+import sys
+import time
 import traceback
 import types
-from typing import Iterable
+import warnings
+from collections import deque
+from contextlib import nullcontext
+from typing import AsyncIterator, Iterable
+
+from ._pools import BACKENDS, new_pool, pool_ok, terminate_pool, shared_pool, close_shared_pools
 
 
 def _wrap_fct(params):
@@ -44,8 +58,302 @@ def _wrap_fct(params):
     return fct(*params[:largs], **dict(params[largs:]))
 
 
-_ALLOWED_TYPE_IN: Set = {'nda', 'str', 'gen'}
-_ALLOWED_TYPE_OUT: Set = {'df', 'nd1', 'nda'}
+def _wrap_chunk(params):
+    """
+    Runs fct over a whole chunk of iterations in a tight loop
+    """
+    fct, largs, keys, pinfo, n_threads, rows = params
+    if not pinfo:
+        res = [fct(*row[:largs], **dict(zip(keys, row[largs:]))) for row in rows]
+    else:
+        res = []
+        for row in rows:
+            d = multiprocessing.Process()._identity + (None,)
+            res.append(fct(*row[:largs], _pinfo=[d[0] % n_threads, d[1]], **dict(zip(keys, row[largs:]))))
+    # e.g. memmap outputs are flushed, and shared memory detached, once per chunk
+    end_task = getattr(fct, 'end_task', None)
+    if end_task is not None:
+        end_task()
+    return res
+
+
+def _column(item, start: int, stop: int) -> list:
+    """
+    Returns the values of input `item` for iterations `start` to `stop`,
+    the last one being repeated past its end
+    """
+    last = len(item) - 1
+    if last == 0:
+        return [item[0]] * (stop - start)
+    elif isinstance(item, _Axis):
+        return item.column(start, stop)
+    elif last < stop - 1:
+        return [item[min(j, last)] for j in range(start, stop)]
+    elif isinstance(item, (list, tuple, range, str)) or type(item).__name__ == 'ndarray':
+        return list(item[start:stop])
+    return [item[j] for j in range(start, stop)]
+
+
+def _rows(params: list, start: int, stop: int) -> list:
+    """
+    Returns the argument values of iterations `start` to `stop`,
+    positional arguments first then keyword arguments
+    """
+    items = params[0] + list(params[1].values())
+    if not items:
+        return [()] * (stop - start)
+    return list(zip(*[_column(item, start, stop) for item in items]))
+
+
+# prepared inputs of the running calls, inherited by the workers forked for them
+_INHERITED: dict = {}
+_TOKENS = itertools.count()
+
+
+def _wrap_range(params):
+    """
+    Same as _wrap_chunk, but resolves the iterations `start` to `stop`
+    from the inputs inherited from the parent process
+    """
+    fct, token, largs, keys, pinfo, n_threads, index, start, stop = params
+    rows = _rows(_INHERITED[token], start, stop)
+    if index:
+        keys += ('_binge_index',)
+        rows = [row + (j,) for j, row in zip(range(start, stop), rows)]
+    return _wrap_chunk((fct, largs, keys, pinfo, n_threads, rows))
+
+
+def _fold_chunk(params):
+    """
+    Runs a chunk of iterations with `wrap` and folds its outputs into a
+    single partial with `reducer`, keeping the task records if profiled
+    """
+    reducer, profiled, wrap, task = params
+    res = wrap(task)
+    if profiled:
+        return [(functools.reduce(reducer, [item for item, _ in res]), [record for _, record in res])]
+    return [functools.reduce(reducer, res)]
+
+
+def _tree_reduce(reducer: Callable, items: list):
+    """
+    Combines the items pairwise with `reducer`, keeping their order
+    """
+    while len(items) > 1:
+        items = [reducer(items[j], items[j + 1]) if j + 1 < len(items) else items[j]
+                 for j in range(0, len(items), 2)]
+    return items[0]
+
+
+def _minimum(a, b):
+    if hasattr(a, '__array_ufunc__') or hasattr(b, '__array_ufunc__'):
+        from numpy import minimum
+        return minimum(a, b)
+    return min(a, b)
+
+
+def _maximum(a, b):
+    if hasattr(a, '__array_ufunc__') or hasattr(b, '__array_ufunc__'):
+        from numpy import maximum
+        return maximum(a, b)
+    return max(a, b)
+
+
+def _set_future(fut, ok: bool, res) -> None:
+    """
+    Sets the outcome of an asyncio future, unless it was cancelled
+    """
+    if fut.done():
+        return
+    if ok:
+        fut.set_result(res)
+    else:
+        fut.set_exception(res)
+
+
+def _release_opened(fut) -> None:
+    """
+    Frees the shared memory splits of a stream opened for nothing
+    """
+    if not fut.cancelled() and fut.exception() is None and fut.result()[2]:
+        from ._shm import release_all
+        release_all(fut.result()[2])
+
+
+def _time_chunk(params):
+    """
+    Runs a chunk of iterations with `wrap`, either _wrap_chunk or
+    _wrap_range, and also returns the time spent per iteration
+    """
+    wrap, task = params
+    t = time.perf_counter()
+    res = wrap(task)
+    return res, (time.perf_counter() - t) / max(1, len(res))
+
+
+def _search_chunk(params):
+    """
+    Runs a chunk of iterations until one output satisfies pred, and
+    returns its index and output, or None if none does
+    """
+    pred, head, start, rows = params
+    for offset, row in enumerate(rows):
+        out = _wrap_chunk(head + ([row],))[0]
+        if pred(out):
+            return start + offset, out
+    return None
+
+
+# the directory of the binge package, whose frames warnings skip
+_PACKAGE: str = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+def _caller_stacklevel() -> int:
+    """
+    Returns the stacklevel of warnings.warn, called by the caller of this
+    function, which points at the first frame outside of binge, whichever
+    entry point it went through
+    """
+    frame, level = sys._getframe(1), 1
+    while frame is not None and frame.f_code.co_filename.startswith(_PACKAGE):
+        frame, level = frame.f_back, level + 1
+    return level
+
+
+_ALLOWED_TYPE_IN: Set = {'nda', 'str', 'gen', 'df', 'series'}
+_ALLOWED_TYPE_OUT: Set = {'df', 'nd1', 'nda', 'memmap'}
+# the named reducers, elementwise for ndarrays
+_REDUCERS: dict = {'sum': operator.add, 'prod': operator.mul, 'min': _minimum, 'max': _maximum}
+
+# target duration of a chunk of iterations when chunksize='auto', in seconds
+_CHUNK_DURATION: float = 0.02
+# minimum number of chunks per worker when chunksize='auto', for load balancing
+_CHUNKS_PER_WORKER: int = 4
+
+# with broadcast=None, the pickled size of fct and constant inputs above which they are broadcast, in bytes
+_BROADCAST_SIZE: int = 65536
+
+# with backend='auto', the time it takes to start a pool of processes, in seconds
+_PROCESS_STARTUP: float = 0.1
+# with backend='auto', the time it takes to start a pool of threads, in seconds
+_THREAD_STARTUP: float = 0.005
+# with backend='auto', the rate at which inputs are sent to processes, in bytes per second
+_IPC_BANDWIDTH: float = 1e9
+# with backend='auto', the number of iterations probed on threads
+_THREAD_PROBE: int = 4
+# with backend='auto', the fraction of the serial time under which threads are worth it
+_THREAD_SPEEDUP: float = 0.6
+
+
+
+class _Blocks(object):
+    """
+    Sequence of the contiguous blocks of `item` delimited by `bounds`
+    """
+
+    def __init__(self, item, bounds: list):
+        self.item = item
+        self.bounds: list = bounds
+
+    def __len__(self) -> int:
+        return len(self.bounds) - 1
+
+    def __getitem__(self, j: int):
+        return self.item[self.bounds[j]:self.bounds[j + 1]]
+
+
+class _Subset(object):
+    """
+    Sequence of the elements of `item` at `indices`
+    """
+
+    def __init__(self, item, indices: list):
+        self.item = item
+        self.indices: list = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, j: int):
+        return self.item[self.indices[j]]
+
+
+class _Tasks(object):
+    """
+    Sequence of `n` tasks, the k-th being built by make(k) when it is sent
+    """
+
+    def __init__(self, make: Callable, n: int):
+        self.make: Callable = make
+        self.n: int = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, k: int):
+        if not 0 <= k < self.n:
+            raise IndexError(k)
+        return self.make(k)
+
+    def __iter__(self):
+        return map(self.make, range(self.n))
+
+
+class _Axis(object):
+    """
+    Sequence of the n points of a grid, giving for each the element of
+    `item` along its axis, found from the point index and the axis stride
+    """
+
+    def __init__(self, item, stride: int, n: int):
+        self.item = item
+        self.size: int = len(item)
+        self.stride: int = stride
+        self.n: int = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, j: int):
+        return self.item[(j // self.stride) % self.size]
+
+    def column(self, start: int, stop: int) -> list:
+        """
+        Returns the elements of points `start` to `stop`, each repeated
+        along its stride
+        """
+        if self.stride == 1:
+            return list(itertools.islice(itertools.cycle(self.item), start % self.size,
+                                         start % self.size + stop - start))
+        res = []
+        for k in range(start // self.stride, (stop - 1) // self.stride + 1):
+            res += [self.item[k % self.size]] * (min(stop, (k + 1) * self.stride) - max(start, k * self.stride))
+        return res
+
+
+class _Rows(object):
+    """
+    Sequence of the rows of a pandas DataFrame or Series, or of its groups
+    of rows given as positional indices
+    """
+
+    def __init__(self, item, groups: list or None = None):
+        self.item = item
+        self.groups: list or None = groups
+
+    def __len__(self) -> int:
+        return len(self.item) if self.groups is None else len(self.groups)
+
+    def __iter__(self):
+        return (self[j] for j in range(len(self)))
+
+    def __getitem__(self, j: int or slice):
+        if self.groups is None:
+            return self.item.iloc[j]
+        elif isinstance(j, slice):
+            from numpy import concatenate
+            return self.item.iloc[concatenate(self.groups[j])]
+        return self.item.iloc[self.groups[j]]
 
 
 class B(object):
@@ -58,7 +366,40 @@ class B(object):
                  type_out: str or None = None,
                  type_in: str or None = None,
                  fwd_pinfo: bool = False,
-                 verbose: bool = False
+                 verbose: bool = False,
+                 shared: bool = False,
+                 chunksize: int or str or None = None,
+                 shm_in: bool = False,
+                 shm_out: bool = False,
+                 out_shape: tuple or None = None,
+                 out_dtype: str or None = None,
+                 inflight: int or None = None,
+                 backend: str = 'process',
+                 blocks: int or bool or None = None,
+                 groupby=None,
+                 stats: bool = False,
+                 on_task_start: Callable or None = None,
+                 on_task_end: Callable or None = None,
+                 broadcast: bool or None = None,
+                 inherit: bool = True,
+                 worker_init: Callable or None = None,
+                 reduce: Callable or str or None = None,
+                 product: bool = False,
+                 cache: str or None = None,
+                 cache_size: int or None = None,
+                 cache_age: float or None = None,
+                 timeout: float or None = None,
+                 retries: int = 0,
+                 speculative: bool = False,
+                 errors: str = 'raise',
+                 serializer: str or None = None,
+                 out_path: str or None = None,
+                 nodes: list or None = None,
+                 authkey: bytes or str or None = None,
+                 affinity: bool or list or None = None,
+                 native_threads: int or str or None = None,
+                 start_method: str or None = None,
+                 preload: list or None = None
                  ):
         """
         Call M(f)(arg1, arg2) instead of f(arg1, arg2) to benefit
@@ -80,9 +421,195 @@ class B(object):
           * fwd_pinfo (bool): if True, passes the process information
             (process_index, process_iteration_index) to the worker
             fct under parameter name '_pinfo'
+          * shared (bool): if True, calls run on the module-level pool
+            of `threads` processes (see `shared_pool`), which stays warm
+            across calls and across B instances
+          * chunksize (int or 'auto' or None): if given, each task sent
+            to a worker is a batch of `chunksize` iterations run in a
+            tight loop, which cuts the dispatch overhead of cheap fct.
+            'auto' runs one iteration per worker first and infers the
+            chunk size from the measured per-iteration cost. None means
+            one task per iteration
+          * shm_in (bool): if True, the ndarray inputs split with
+            type_in='nda' are copied once into shared memory, and each
+            iteration receives a read-only view on its element instead
+            of a pickled copy
+          * shm_out (bool): if True and type_out is 'nd1' or 'nda', the
+            output ndarray is preallocated in shared memory and each
+            iteration writes its output straight into its slot, which
+            avoids sending the outputs back and concatenating them.
+            All iterations must output the same shape
+          * out_shape (tuple or None): with shm_out, the shape of the
+            output of one iteration. None means infer from the output of
+            the first iteration
+          * out_dtype (str or None): with shm_out, the dtype of the
+            output. None means infer from the output of the first iteration
+          * inflight (int or None): with imap and imap_unordered, the
+            maximum number of tasks sent to the workers and not yet
+            collected. None means twice the number of threads. The
+            asynchronous API also never sends more tasks than there are
+            workers free, so that cancelling it leaves no queued work
+          * backend (str): what runs the iterations, see below
+          * blocks (int or True or None): if given, the split inputs are
+            cut into `blocks` contiguous blocks along their first
+            dimension, or one block per thread if True, and fct is called
+            once per block instead of once per element, which keeps
+            vectorized fct vectorized. The block outputs are stitched
+            along their first dimension with type_out 'nd1' or 'nda'
+          * groupby (anything DataFrame.groupby accepts, or None): with
+            type_in 'df', the DataFrames are split by groups of rows
+            instead of by rows, fct being called once per group. The
+            groups of the first DataFrame input apply to all pandas inputs
+          * stats (bool): if True, each call records its execution
+            statistics in the `stats` attribute: phase timings, per
+            iteration wall and CPU times and pickled sizes, and per worker
+            busy and idle times. See binge._stats.Stats
+          * on_task_start (callable or None): called in the worker before
+            each iteration with a dict of its index, pid, thread and start
+            time. Must be picklable with the process backend
+          * on_task_end (callable or None): called in the worker after
+            each iteration with the dict of its statistics
+          * broadcast (bool or None): if True, fct and the inputs which
+            are the same for all iterations are pickled once into shared
+            memory and loaded once by each worker, instead of being sent
+            along with every task. None means only if they weigh more
+            than 64 kB once pickled. Only applies to the process backend
+          * inherit (bool): if True, with the fork start method, the calls
+            which open their own pool of processes leave the prepared
+            inputs in the memory of the parent process for the workers to
+            inherit, and each task is just a range of iteration indices
+            resolved by the worker, about `threads` x 4 of them unless
+            chunksize is given. Inputs are then neither copied nor
+            pickled, which suits huge n. Ignored with shm_in or
+            broadcast=True
+          * worker_init (callable or None): if given, fct receives under
+            parameter name '_state' a dict which is local to the worker
+            and persists across the iterations and calls it runs, and
+            worker_init is called with this dict once per worker, before
+            its first iteration, to set up what the iterations reuse such
+            as a loaded model or an open file. Workers are the processes,
+            the threads, or the calling thread depending on the backend.
+            Must be picklable with the process backend
+          * reduce (callable or str or None): if given, the call returns
+            the outputs folded with this associative function of two
+            outputs, or with one of the named reducers 'sum', 'prod', 'min'
+            and 'max'. Each task folds its chunk of iterations in the
+            worker and sends back a single partial, and the partials are
+            combined pairwise in order in the parent, so the parent never
+            holds all outputs. Iterations are then sent by chunks, about
+            `threads` x 4 of them unless chunksize is given. type_out and
+            shm_out are ignored. Must be picklable with the process backend
+          * product (bool): if True, fct is called on the Cartesian product
+            of the split inputs instead of on the split inputs zipped
+            together, see Grid below
+          * cache (str or None): if given, the directory where the output
+            of each iteration is stored as soon as it is computed, keyed by
+            a hash of fct and of the iteration inputs. The iterations found
+            in the cache are not run again, so a call which was interrupted
+            resumes from the iterations it completed. Inputs which pickle
+            differently from one run to the other, such as sets of str,
+            are never found. Ignored by imap and acall
+          * cache_size (int or None): with cache, the total size in bytes
+            above which the oldest outputs are evicted after each call
+          * cache_age (float or None): with cache, the age in seconds above
+            which outputs are ignored and evicted
+          * timeout (float or None): if given, a task which runs longer
+            than `timeout` seconds is given up on, see Stragglers below
+          * retries (int): how many times a task which raised or timed out
+            is run again before it is considered failed
+          * speculative (bool): if True, workers left idle at the end of a
+            call run a second copy of the oldest running tasks, and the
+            first copy to finish wins
+          * errors (str): 'raise' to raise the error of the first failed
+            task, or 'return' to return a binge.TaskError in place of the
+            output of each failed iteration along with the others
+          * serializer (str or None): how the tasks and outputs are sent
+            to and from the worker processes, see below. None means the
+            default pickling of multiprocessing
+          * out_path (str or None): with type_out='memmap', the .npy file
+            to write the output to. None means a new temporary file
+          * nodes (list or None): with the cluster backend, the addresses
+            of the worker servers, as (host, port) or 'host:port'
+          * authkey (bytes or str or None): with the cluster backend, the
+            secret shared with the worker servers. None means the
+            BINGE_AUTHKEY environment variable, which is required unless
+            all nodes are on the loopback interface
+          * affinity (bool or list or None): if True, each worker is pinned
+            to its own set of CPUs: the workers are spread round-robin over
+            the NUMA nodes and the CPUs of each node are split among its
+            workers. A list of CPU sets pins worker i to the set i modulo
+            its length. Workers are indexed like for '_pinfo', and stay
+            pinned for the lifetime of the pool. Linux only
+          * native_threads (int or 'auto' or None): if given, caps the
+            thread pools of BLAS, OpenMP and co in each worker to this
+            many threads, which avoids `threads` workers each starting a
+            pool as large as the machine. 'auto' means the size of the
+            CPU set of the worker with affinity, else the CPUs divided by
+            threads. Libraries already loaded by the worker, as with the
+            fork start method, are only capped if threadpoolctl is installed.
+            affinity and native_threads only apply to worker processes: they
+            are refused with the thread and serial backends, and skipped if
+            backend 'auto' runs the iterations in the calling process
+          * start_method (str or None): how the worker processes are
+            started: 'fork', 'spawn' or 'forkserver'. None means the
+            platform default. Inputs are only inherited with fork
+          * preload (list or None): the modules, such as 'numpy' or
+            'pandas', the worker processes import when they start rather
+            than on their first task. They are imported once in the parent
+            with fork, once in the fork server with forkserver, provided
+            it is not running yet, and in each worker with spawn
+
+        backend:
+          * process: a pool of `threads` processes
+          * thread: a pool of `threads` threads, for fct which are I/O
+            bound or release the GIL, without process startup and pickling
+          * serial: all iterations run one after the other in the calling
+            thread, for debugging or tiny inputs
+          * cluster: the tasks are sent over TCP to the worker servers
+            `nodes`, started on each host with `BINGE_AUTHKEY=secret
+            python -m binge.cluster --host 0.0.0.0 --port 5000`, which
+            run them on their own pool of processes and stream the outputs
+            back as they complete. Each node is kept busy in proportion to
+            its number of workers, and fct and the constant inputs weighing
+            more than 64 kB are stored once per node. fct must be importable
+            on the nodes, and memmap outputs need a file system shared with
+            them. Only use on a trusted network
+          * auto: times the first iterations inline and on threads, then
+            picks serial if the whole run is shorter than the cost of
+            processes, thread if fct runs concurrently on threads, and
+            process otherwise. Streaming calls use processes
+
+        serializer:
+          * pickle: the highest pickle protocol, which pickles ndarrays
+            without copying them first
+          * cloudpickle: also sends lambdas, closures and functions defined
+            in __main__ or a notebook, requires cloudpickle
+          * pickle5: pickle protocol 5 with the large buffers, such as the
+            data of ndarrays, sent out-of-band through shared memory: they
+            are copied once into it and loaded as views on it
+          * any name given to binge.register_serializer, e.g. for a
+            serializer which knows how to send domain objects
+
+        Pool lifecycle:
+          By default, each call opens and tears down its own pool. To keep
+          the workers warm across calls, either use B as a context
+          manager, or call `start()` and `close()` explicitly:
+          > with B(f) as bf:
+          >     for x in many_inputs:
+          >         bf(x)
+          Pools which lost a worker are re-created before the next call
+
+        Pipelines:
+          B instances chained with | form a binge.Pipeline, each stage
+          being called with the output of the previous one:
+          > (B(f) | B(g) | B(h, type_out='nda'))(inputs)
+          Element-wise stages on the same backend run back to back in the
+          same task, and the outputs of the others stream to the next
+          stage as they come
 
         type_out:
-          * df: the output will be concatenated into a single pandas df
+          * df: the output will be concatenated into a single pandas df,
+            keeping the dtypes and index of the threads outputs
           * nd1: the output will be a stack of the first dimension of
             the threads outputs.
             e.g. thread1: shape=(2,3), thread2: shape=(7,3)
@@ -91,6 +618,15 @@ class B(object):
             the threads outputs, which need to have all the same shape.
             e.g. thread1: shape=(7,3), thread2: shape=(7,3)
                 output will be of shape=(2,7,3)
+          * memmap: same as nda, but the output is preallocated in the
+            .npy file out_path, each iteration writes its output straight
+            into it, and the output is returned as a np.memmap on the file,
+            so that it is only limited by the disk space. The workers flush
+            the file at the end of each chunk of iterations. out_shape and
+            out_dtype apply as with shm_out. A path ending with '.npy'
+            is the same as 'memmap' with out_path. Without out_path, the
+            temporary file is removed once the output is collected, the
+            returned np.memmap keeping its data mapped
 
         type_in:
           * nda: any input of type numpy array will be distributed along
@@ -98,6 +634,45 @@ class B(object):
           * str: any input of str- or bytes-like types will be
             distributed as if a list of single characters
           * gen: any input of generators types will be distributed
+          * df: any input of pandas DataFrame type will be distributed
+            along its rows, or its groups of rows if groupby is given
+          * series: any input of pandas Series type will be distributed
+            along its rows
+
+        Grid:
+          With product=True, each split input is an axis of a grid and
+          fct is called once per point of the grid, the last axis varying
+          the fastest as with itertools.product. The points are computed
+          from their index and never stored, so grids of millions of
+          points cost nothing to prepare. The outputs come back as an
+          ndarray of shape: the length of each axis, followed by the shape
+          of one output, as with type_out='nda' which is the default:
+          > B(f, product=True)([1, 2, 3], y=[0., 1.]).shape
+          > (3, 2)
+          imap yields the outputs in the same order, flat
+
+        Stragglers:
+          With timeout, retries, speculative or errors='return', calls send
+          one task per iteration or per chunk, and at most one per free
+          worker, so that each task is timed from when it starts. A task
+          which timed out cannot be stopped: its worker is not given new
+          tasks, and the pool is torn down after the call, a warm pool
+          being re-created by the next call. chunksize='auto' splits the
+          iterations evenly instead of sampling them. Only apply to calls
+
+        Streaming:
+          B(f).imap(...) and B(f).imap_unordered(...) take the same inputs
+          as a call, but return an iterator which yields the outputs as
+          they come, respectively in order and in completion order. With
+          type_in='gen', the generators are consumed lazily as workers
+          free up, so unbounded inputs run in constant memory
+
+        Asyncio:
+          From within an event loop, `await B(f).acall(...)` returns the
+          outputs like a call without blocking the loop, the options which
+          are specific to calls aside, and `async for` over B(f).aimap(...)
+          or B(f).aimap_unordered(...) streams the outputs. The inputs are
+          prepared, copied to shared memory or broadcast off the loop
 
         Example:
           > def f(x, y=1., p=2.): return (x*y)**p
@@ -135,7 +710,15 @@ class B(object):
         self._split_str: bool = False if self.type_in is None else ('str' in self.type_in)
         self._split_ndarray: bool = False if self.type_in is None else ('nda' in self.type_in)
         self._split_gen: bool = False if self.type_in is None else ('gen' in self.type_in)
+        self._split_pandas: bool = False if self.type_in is None else bool({'df', 'series'} & self.type_in)
+        if self._split_pandas:
+            # requested pandas input to be split, so allow fail if cannot import
+            import pandas
+        self.groupby = groupby
 
+        self._product: bool = bool(product)
+        if self._product and type_out is None:
+            type_out = 'nda'
         ndarray = None
         if self._split_ndarray:
             # requested numpy input to be split, so allow fail if cannot import
@@ -149,11 +732,252 @@ class B(object):
                 pass
         self.ndarray = ndarray
         self.type_out: str or None = str(type_out) if type_out is not None else None
+        if self.type_out is not None and self.type_out.endswith('.npy'):
+            out_path = self.type_out
+            self.type_out = 'memmap'
+        self.out_path: str or None = out_path
         self._fwd_pinfo: bool = bool(fwd_pinfo)
+        self._shared: bool = bool(shared)
+        self._shm_in: bool = bool(shm_in) and self._split_ndarray
+        if blocks is None or blocks is False:
+            self.blocks: int or bool or None = None
+        elif blocks is True:
+            self.blocks = True
+        elif int(blocks) > 0:
+            self.blocks = int(blocks)
+        else:
+            raise ValueError(f"blocks '{blocks}' not understood")
+        if self.blocks is not None and self._product:
+            raise ValueError("blocks and product can't be combined")
+        if reduce is None or callable(reduce):
+            self._reducer: Callable or None = reduce
+        elif reduce in _REDUCERS:
+            self._reducer = _REDUCERS[reduce]
+        else:
+            raise ValueError(f"reduce '{reduce}' not understood")
+        if errors not in ('raise', 'return'):
+            raise ValueError(f"errors '{errors}' not understood")
+        elif errors == 'return' and self._reducer is not None:
+            raise ValueError("errors='return' and reduce can't be combined")
+        self.errors: str = errors
+        self.timeout: float or None = None if timeout is None else float(timeout)
+        self.retries: int = max(0, int(retries))
+        self.speculative: bool = bool(speculative)
+        self._resilient: bool = (self.timeout is not None or self.retries > 0 or self.speculative or
+                                 self.errors == 'return')
+        # whether tasks which timed out may still be running on the pool after a call
+        self._abandoned: bool = False
+        if serializer is not None:
+            from ._serialize import get_serializer
+            self._serializer = get_serializer(serializer)
+        else:
+            self._serializer = None
+        if cache is not None and self._reducer is not None:
+            raise ValueError("cache and reduce can't be combined")
+        elif cache is not None:
+            from ._cache import Cache
+            self.cache = Cache(cache, cache_size, cache_age)
+        else:
+            self.cache = None
+        if self.type_out == 'memmap' and (self.blocks is not None or self.cache is not None):
+            raise ValueError("type_out 'memmap' can't be combined with blocks or cache")
+        self._memmap: bool = self.type_out == 'memmap' and self._reducer is None
+        # blocks may not all have the same size, cached outputs are not in shared memory
+        self._shm_out: bool = (bool(shm_out) and self.type_out in ('nd1', 'nda') and self.blocks is None and
+                               self._reducer is None and self.cache is None)
+        self._out_shape: tuple or None = tuple(out_shape) if out_shape is not None else None
+        self._out_dtype: str or None = out_dtype
+        self.inflight: int = 2 * self.threads if inflight is None else max(1, int(inflight))
+        if chunksize is None or chunksize == 'auto':
+            self.chunksize: int or str or None = chunksize
+        elif int(chunksize) > 0:
+            self.chunksize = int(chunksize)
+        else:
+            raise ValueError(f"chunksize '{chunksize}' not understood")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend '{backend}' not understood")
+        self.backend: str = backend
+        if backend == 'cluster' and not nodes:
+            raise ValueError("backend 'cluster' requires nodes")
+        self.nodes: list = list(nodes) if nodes else []
+        self._authkey: bytes or str or None = authkey
+        self._pool: multiprocessing.pool.Pool or None = None
+        self._on_task_start: Callable or None = on_task_start
+        self._on_task_end: Callable or None = on_task_end
+        self._broadcast: bool or None = broadcast if broadcast is None else bool(broadcast)
+        # broadcast kept from one call to the next on the warm pool
+        self._broadcasted = None
+        self._inherit: bool = bool(inherit)
+        self._worker_init: Callable or None = worker_init
+        self._affinity: bool or list or None = affinity
+        if start_method is not None and start_method not in multiprocessing.get_all_start_methods():
+            raise ValueError(f"start_method '{start_method}' not understood")
+        self._start_method: str or None = start_method
+        self._preload: tuple = tuple(preload) if preload else ()
+        if native_threads is None or native_threads == 'auto':
+            self._native_threads: int or str or None = native_threads
+        elif int(native_threads) > 0:
+            self._native_threads = int(native_threads)
+        else:
+            raise ValueError(f"native_threads '{native_threads}' not understood")
+        if (affinity or native_threads is not None) and backend in ('thread', 'serial'):
+            # they would change the calling process for good
+            raise ValueError(f"affinity and native_threads need worker processes, not backend '{backend}'")
+        if worker_init is not None:
+            from ._state import new_key
+            self._state_key: tuple or None = new_key()
+        else:
+            self._state_key = None
+        # key of the inputs inherited by the workers during a call
+        self._token: int or None = None
+        self._profile: bool = bool(stats) or on_task_start is not None or on_task_end is not None
+        # statistics of the last call, if requested
+        self.stats = None
+        # with product, the length of each axis of the grid of the last call
+        self._grid: tuple = ()
+        # whether the last prepared inputs had pandas inputs split by label, see _warn_by_label
+        self._split_by_label: bool = False
+
+    @property
+    def _pool_backend(self) -> str:
+        """
+        The backend of the pool kept warm, and of the streaming calls
+        """
+        return 'process' if self.backend == 'auto' else self.backend
+
+    def start(self) -> B:
+        """
+        Starts a pool of `threads` workers which is kept warm and
+        re-used by all subsequent calls until `close()` is called
+        """
+        if not pool_ok(self._pool):
+            if self._pool is not None:
+                terminate_pool(self._pool)
+            self._pool = new_pool(self.threads, self._pool_backend, self.nodes, self._authkey, self._start_method,
+                                  self._preload)
+        return self
+
+    def close(self) -> None:
+        """
+        Closes and joins the pool started with `start()`, if any
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._broadcasted is not None:
+            self._broadcasted.release()
+            self._broadcasted = None
+
+    def __enter__(self) -> B:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        self.close()
+
+    def _get_pool(self, backend: str or None = None) -> tuple:
+        """
+        Returns the pool of `backend` to run a call on and whether it is a
+        temporary pool which must be torn down after the call
+        """
+        backend = self._pool_backend if backend is None else backend
+        if self._pool is not None and backend == self._pool_backend:
+            # make sure the warm pool is still healthy, respawn if not
+            return self.start()._pool, False
+        elif self._shared and backend not in ('serial', 'cluster'):
+            return shared_pool(self.threads, backend, self._start_method, self._preload), False
+        return new_pool(self.threads, backend, self.nodes, self._authkey, self._start_method, self._preload), True
+
+    def _task_fct(self) -> Callable:
+        """
+        Returns the callable to run for each iteration
+        """
+        fct = self._fct
+        if self._worker_init is not None:
+            from ._state import StateCall
+            fct = StateCall(fct, self._worker_init, self._state_key)
+        if self._affinity or self._native_threads is not None:
+            from ._affinity import PinCall
+            fct = PinCall(fct, self._affinity, self._native_threads, self.threads)
+        return fct
+
+    def _inherits(self, backend: str) -> bool:
+        """
+        Whether a call on `backend` forks a new pool of workers which can
+        inherit the prepared inputs
+        """
+        return (self._inherit and backend == 'process' and self._pool is None and not self._shared and
+                not self._shm_in and not self._broadcast and
+                (self._start_method or multiprocessing.get_start_method()) == 'fork')
+
+    def _serializing(self, pool, backend: str or None = None):
+        """
+        Returns the pool through which to send the tasks: `pool`, or a
+        wrapper which goes through the serializer across processes
+        """
+        backend = self._pool_backend if backend is None else backend
+        if self._serializer is None or backend not in ('process', 'cluster'):
+            return pool
+        from ._serialize import SerializingPool
+        return SerializingPool(pool, self._serializer)
+
+    @staticmethod
+    def _release_serialized(run_pool, pool) -> None:
+        """
+        Discards what the serializer left behind, e.g. the shared memory
+        of the tasks which were not run if the call failed or stopped early
+        """
+        if run_pool is not pool:
+            run_pool.release()
+
+    def _pick_backend(self, params: list, fct: Callable) -> tuple:
+        """
+        Runs the first iteration inline and a few more on threads, and
+        picks the backend from n, the payload size and the timings.
+        Returns the backend and the outputs of the probed iterations
+        """
+        head = (fct, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads)
+        rows = _rows(params, 0, 1)
+        t = time.perf_counter()
+        mapped_pool = _wrap_chunk(head + (rows,))
+        per_item = time.perf_counter() - t
+        remaining = self.n - 1
+        try:
+            if self._serializer is not None and self._serializer.bytes_only:
+                payload = len(self._serializer.dumps((fct, rows[0])))
+            else:
+                payload = len(pickle.dumps((fct, rows[0]), protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            # fct or its inputs cannot be sent to other processes
+            payload = None
+        warm = self._pool is not None or self._shared
+        if payload is not None:
+            # serial run time against the cost of processes: startup and inputs transfer
+            overhead = (0 if warm else _PROCESS_STARTUP) + payload * remaining / _IPC_BANDWIDTH
+            if per_item * remaining < overhead:
+                return 'serial', mapped_pool
+        elif per_item * remaining < _THREAD_STARTUP:
+            return 'serial', mapped_pool
+        # check whether fct runs concurrently on threads, which it does if it releases the GIL
+        n_probe = min(remaining, self.threads, _THREAD_PROBE)
+        if n_probe > 1:
+            from multiprocessing.pool import ThreadPool
+            with ThreadPool(processes=n_probe) as probe:
+                t = time.perf_counter()
+                mapped_pool += probe.map(_wrap_chunk, [head + ([row],) for row in _rows(params, 1, 1 + n_probe)])
+                elapsed = time.perf_counter() - t
+            if elapsed < _THREAD_SPEEDUP * n_probe * per_item or payload is None:
+                return 'thread', mapped_pool
+        elif payload is None:
+            return 'serial', mapped_pool
+        return 'process', mapped_pool
 
     def _info(self) -> str:
         f_name = getattr(self._fct, 'func_name', self._fct.__name__)
-        return f"Multi-processing wrapper for {self._font_blue}{f_name}{self._font_normal} over {self.threads} processes"
+        workers = {'process': f"{self.threads} processes", 'thread': f"{self.threads} threads",
+                   'serial': "a single thread", 'cluster': f"{len(self.nodes)} nodes",
+                   'auto': f"{self.threads} processes or threads"}[self.backend]
+        return f"Multi-processing wrapper for {self._font_blue}{f_name}{self._font_normal} over {workers}"
 
     def __repr__(self):
         return self._info()
@@ -174,7 +998,13 @@ class B(object):
             # we have a numpy array so just do as per instruction
             return self._split_ndarray
 
-        if isinstance(item, str):
+        if isinstance(item, _Rows):
+            # pandas input requested to be split
+            return True
+        elif self._pandas_type(item) is not None:
+            # pandas inputs not requested to be split keep the former element-wise handling, by label
+            return True
+        elif isinstance(item, str):
             # and we have a string input so we go as per instruction
             return self._split_str
         elif isinstance(item, types.GeneratorType):
@@ -182,82 +1012,859 @@ class B(object):
             return self._split_gen
         return isinstance(item, Iterable)
 
-    def __call__(self, *args, **kwargs):
+    @staticmethod
+    def _pandas_type(item) -> str or None:
+        """
+        Returns 'df' or 'series' if item is a pandas DataFrame or Series
+        """
+        # no pandas input can exist if pandas was not imported by the user
+        pandas = sys.modules.get('pandas')
+        if pandas is None:
+            return None
+        elif isinstance(item, pandas.DataFrame):
+            return 'df'
+        elif isinstance(item, pandas.Series):
+            return 'series'
+        return None
+
+    def _by_label(self, params: list, split: list) -> bool:
+        """
+        Checks whether pandas inputs among the `split` ones are split
+        element-wise by label
+        """
+        return any(self._pandas_type(params[p][idx]) is not None for p, idx in split)
+
+    def _warn_by_label(self) -> None:
+        """
+        Warns once per call if the last prepared inputs had pandas inputs
+        split by label, pointing at the code calling binge. Called in the
+        thread of the caller, once the inputs are prepared
+        """
+        if self._split_by_label:
+            self._split_by_label = False
+            warnings.warn("pandas inputs are split element-wise by label when type_in does not include 'df' or "
+                          "'series', which will change to passing them whole: add 'df' or 'series' to type_in to "
+                          "split them by rows", DeprecationWarning, stacklevel=_caller_stacklevel())
+
+    def _split_frames(self, params: list) -> None:
+        """
+        Replaces in place the pandas inputs to be split by sequences of
+        their rows, or of their groups of rows if groupby was given
+        """
+        frames = [(p, idx) for p, param in [(0, enumerate(params[0])), (1, params[1].items())]
+                  for idx, item in param if self._pandas_type(item) in self.type_in]
+        groups = None
+        if self.groupby is not None:
+            # the groups of the first DataFrame apply to all split pandas inputs
+            first = next((params[p][idx] for p, idx in frames if self._pandas_type(params[p][idx]) == 'df'), None)
+            if first is not None:
+                groups = list(first.groupby(self.groupby, sort=True).indices.values())
+        for p, idx in frames:
+            params[p][idx] = _Rows(params[p][idx], groups)
+
+    def _prepare(self, args: tuple, kwargs: dict, min_n: int = 1) -> list:
+        """
+        Infers the number of iterations n, at least `min_n`, and wraps all
+        inputs which are not to be split into fake 1-item lists
+        """
         # init number of multi-iteration
-        params = [list(args), kwargs]
+        params = [list(args), dict(kwargs)]
+        if self._split_pandas:
+            self._split_frames(params)
+        # inspect all inputs once
+        inspected = []
+        for p, param in [(0, enumerate(params[0])), (1, params[1].items())]:
+            for idx, item in param:
+                inspected.append((p, idx, self._inspect_it(item)))
+                if isinstance(item, types.GeneratorType):
+                    # can't take len nor pickle generators, gotta force it into a tuple
+                    params[p][idx] = tuple(item)
+        if self._product:
+            return self._prepare_grid(params, inspected)
         # initial instruction was unknown, need to infer the n
         if self._n is None:
-            self.n = 1
-            # check all input arguments
-            for p, param in [(0, enumerate(params[0])), (1, params[1].items())]:
-                for idx, item in param:
-                    # this input is inspect-compatible
-                    if self._inspect_it(item):
-                        if isinstance(item, types.GeneratorType):
-                            # can't take len of generator, gotta force it into a tuple
-                            item = tuple(item)
-                            params[p][idx] = item
-                        # keep the longest dimension to infer n
-                        self.n = max(self.n, len(item))
-                        if self.verbose:
-                            print(f"Input index '{idx}' iterable with size {len(item)}, iterations is {self.n}")
-                    elif self.verbose:
-                        print(f"Input index '{idx}' skipped")
+            self.n = min_n
+            for p, idx, inspect in inspected:
+                # this input is inspect-compatible
+                if inspect:
+                    # keep the longest dimension to infer n
+                    self.n = max(self.n, len(params[p][idx]))
+                    if self.verbose:
+                        print(f"Input index '{idx}' iterable with size {len(params[p][idx])}, iterations is {self.n}")
+                elif self.verbose:
+                    print(f"Input index '{idx}' skipped")
         if self.verbose:
             print(f"Will do {self.n:d} iterations\nWill use {self.threads:d} threads")
 
-        # go through args and kwargs input arguments and make lists of it if need be
+        # make lists of the inputs if need be
+        split = []
+        for p, idx, inspect in inspected:
+            if inspect and len(params[p][idx]) == self.n:
+                split.append((p, idx))
+            else:
+                # item not inspect-compatible, or its length is not the one we want to iterate on
+                # wrap it into a fake 1-item list
+                params[p][idx] = [params[p][idx]]
+        self._split_by_label = self._by_label(params, split)
+
+        if self.blocks is not None:
+            # cut all split inputs into contiguous blocks, one iteration per block
+            n_blocks = min(self.n, self.threads if self.blocks is True else self.blocks)
+            bounds = [j * self.n // n_blocks for j in range(n_blocks + 1)]
+            for p, idx in split:
+                params[p][idx] = _Blocks(params[p][idx], bounds)
+            self.n = n_blocks
+            if self.verbose:
+                print(f"Will do {self.n:d} blocks")
+        return params
+
+    def _prepare_grid(self, params: list, inspected: list) -> list:
+        """
+        Same as _prepare with product: makes each split input an axis of
+        the grid and sets n to the number of points of the grid
+        """
+        axes = [(p, idx) for p, idx, inspect in inspected if inspect]
+        self._split_by_label = self._by_label(params, axes)
+        self._grid = tuple(len(params[p][idx]) for p, idx in axes)
+        self.n = math.prod(self._grid)
+        for k, (p, idx) in enumerate(axes):
+            params[p][idx] = _Axis(params[p][idx], math.prod(self._grid[k + 1:]), self.n)
+        for p, idx, inspect in inspected:
+            if not inspect:
+                params[p][idx] = [params[p][idx]]
+        if self.verbose:
+            print(f"Will do {self.n:d} iterations over a grid of shape {self._grid}")
+        return params
+
+    def _prepare_lazy(self, args: tuple, kwargs: dict) -> tuple:
+        """
+        Same as _prepare, but leaves the generators to be split aside so
+        that they can be consumed lazily. Returns the params, the
+        generators by position in the rows, and the number of iterations
+        or None if it is only bounded by the generators.
+        The generators are split inputs of unknown length, so that the
+        same inputs are split or kept constant as when calling B: the
+        items of each one are pulled ahead up to the length of the longest
+        other split input. Those which end by then are split as any other
+        input, and if one goes on, it is longer than all other inputs,
+        which are therefore constant, and n is only bounded by the
+        generators. Generators which go on stop at the shortest of them
+        """
+        args = list(args)
+        kwargs = dict(kwargs)
+        lazy = {}
+        # with product, all axes need their length
+        if self._split_gen and not self._product:
+            for p, param in [(0, enumerate(args)), (1, kwargs.items())]:
+                for idx, item in list(param):
+                    if isinstance(item, types.GeneratorType):
+                        lazy[(p, idx)] = item
+        min_n = 1
+        if lazy and self._n is None:
+            known = max((len(item) for key, item in itertools.chain(enumerate(args), kwargs.items())
+                         if not isinstance(item, types.GeneratorType) and self._inspect_it(item)), default=0)
+            for (p, idx), gen in list(lazy.items()):
+                head = tuple(itertools.islice(gen, known + 1))
+                if len(head) <= known:
+                    # ended, it is split as any other input
+                    (args, kwargs)[p][idx] = head
+                    del lazy[(p, idx)]
+                else:
+                    lazy[(p, idx)] = itertools.chain(head, gen)
+                    min_n = known + 1
+        for p, idx in lazy:
+            (args, kwargs)[p][idx] = None
+        bounded = self._n is not None or self._product or not lazy
+        params = self._prepare(args, kwargs, min_n)
+        keys = list(params[1].keys())
+        lazy = {(idx if p == 0 else len(params[0]) + keys.index(idx)): item for (p, idx), item in lazy.items()}
+        n = self.n if bounded else None
+        # back to initial instruction
+        self.n = self._n if self._n is not None else 1
+        return params, lazy, n
+
+    @staticmethod
+    def _lazy_rows(params: list, lazy: dict, n: int or None) -> Iterable:
+        """
+        Yields the argument values of each iteration, pulling one item
+        from each lazy generator, until n iterations or until a generator
+        is exhausted
+        """
+        items = params[0] + list(params[1].values())
+        for j in (range(n) if n is not None else itertools.count()):
+            row = [item[min(j, len(item) - 1)] for item in items]
+            for pos, gen in lazy.items():
+                try:
+                    row[pos] = next(gen)
+                except StopIteration:
+                    return
+            yield tuple(row)
+
+    def _auto_chunksize(self, pool, params: list, fct: Callable, start: int) -> tuple:
+        """
+        Runs a short sampling phase of one iteration per worker from
+        iteration `start`, and returns the sampled results and the chunk
+        size inferred from the measured per-item cost
+        """
+        n_sample = min(self.n - start, self.threads)
+        if self._token is not None:
+            head = self._range_head(params, fct)
+            tasks = [(_wrap_range, head + (j, j + 1)) for j in range(start, start + n_sample)]
+        else:
+            head = (fct, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads)
+            tasks = [(_wrap_chunk, head + ([row],)) for row in _rows(params, start, start + n_sample)]
+        sampled = pool.map(_time_chunk, tasks, chunksize=1)
+        per_item = sorted(elapsed for _, elapsed in sampled)[n_sample // 2]
+        remaining = self.n - start - n_sample
+        # a chunk should take long enough to hide the dispatch overhead but
+        # each worker should still get a few chunks to balance the load
+        chunksize = int(_CHUNK_DURATION / per_item) + 1 if per_item > 0 else remaining
+        chunksize = max(1, min(chunksize, -(-remaining // (self.threads * _CHUNKS_PER_WORKER))))
+        if self.verbose:
+            print(f"Sampled {per_item:.2e} s per iteration, will use chunks of {chunksize:d} iterations")
+        return [res[0] for res, _ in sampled], chunksize
+
+    def _run(self, pool, params: list, fct: Callable, start: int = 0) -> list:
+        """
+        Dispatches iterations `start` to n to the pool and gathers the
+        outputs in order, recording the task statistics if requested
+        """
+        if not self._profile:
+            return self._dispatch(pool, params, fct, start)
+        from ._stats import Profiled
+        if '_binge_index' not in params[1] and self._token is None:
+            params[1]['_binge_index'] = range(self.n)
+        self.stats.dispatch()
+        mapped_pool = self._dispatch(pool, params, Profiled(fct, self._on_task_start, self._on_task_end), start)
+        return self.stats.collect(mapped_pool)
+
+    def _dispatch(self, pool, params: list, fct: Callable, start: int) -> list:
+        """
+        Sends iterations `start` to n to the pool, one per task or by
+        chunks, and gathers the outputs in order
+        """
+        if self._token is not None:
+            return self._dispatch_ranges(pool, params, fct, start)
+        # outputs and inputs mapped by the workers are mapped once per chunk,
+        # and the points of a grid are only computed as their chunk is sent
+        if (self.chunksize is None and self._reducer is None and not self._resilient and not self._memmap and
+                not self._shm_in and not self._shm_out and not self._product):
+            # make the single parameter list for the pool
+            all_params = [[fct, len(params[0]), self._fwd_pinfo, self.threads] +
+                          list(row[:len(params[0])]) + list(zip(params[1].keys(), row[len(params[0]):]))
+                          for row in _rows(params, start, self.n)]
+            return pool.map(_wrap_fct, all_params)
+        mapped_pool = []
+        done = start
+        if self.chunksize == 'auto' and start < self.n and not self._resilient:
+            mapped_pool, chunksize = self._auto_chunksize(pool, params, fct, start)
+            done += len(mapped_pool)
+        else:
+            chunksize = self._chunksize(start)
+        head = (fct, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads)
+        chunks = _Tasks(lambda k: head + (_rows(params, done + k * chunksize,
+                                                min(done + (k + 1) * chunksize, self.n)),),
+                        -(-(self.n - done) // chunksize))
+        return mapped_pool + self._map_chunks(pool, _wrap_chunk, chunks)
+
+    def _chunksize(self, start: int) -> int:
+        """
+        Returns chunksize if it is an int, else the chunk size which splits
+        iterations `start` to n into a few chunks per worker
+        """
+        if isinstance(self.chunksize, int):
+            return self.chunksize
+        elif self.chunksize is None and self._resilient and self._reducer is None:
+            # stragglers are handled per iteration
+            return 1
+        return max(1, -(-(self.n - start) // (self.threads * _CHUNKS_PER_WORKER)))
+
+    def _map_chunks(self, pool, wrap: Callable, tasks: list) -> list:
+        """
+        Runs the chunks of iterations `tasks` with `wrap` and gathers their
+        outputs in order, or their folded partials with reduce
+        """
+        if self._reducer is not None:
+            head, chunks = (self._reducer, self._profile, wrap), tasks
+            wrap, tasks = _fold_chunk, _Tasks(lambda k: head + (chunks[k],), len(chunks))
+        if self._resilient:
+            return self._map_resilient(pool, wrap, tasks)
+        mapped_pool = []
+        for res in pool.map(wrap, tasks, chunksize=1):
+            mapped_pool += res
+        return mapped_pool
+
+    def _dispatch_ranges(self, pool, params: list, fct: Callable, start: int) -> list:
+        """
+        Sends iterations `start` to n to the pool as ranges of indices,
+        which the workers resolve from the inputs they inherited
+        """
+        mapped_pool = []
+        done = start
+        if self.chunksize == 'auto' and start < self.n and not self._resilient:
+            mapped_pool, chunksize = self._auto_chunksize(pool, params, fct, start)
+            done += len(mapped_pool)
+        else:
+            chunksize = self._chunksize(start)
+        head = self._range_head(params, fct)
+        return mapped_pool + self._map_chunks(pool, _wrap_range, [head + (j, min(j + chunksize, self.n))
+                                                                  for j in range(done, self.n, chunksize)])
+
+    def _range_head(self, params: list, fct: Callable) -> tuple:
+        """
+        Returns the parameters shared by the tasks of _wrap_range
+        """
+        return (fct, self._token, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads,
+                getattr(fct, 'needs_index', False))
+
+    def _use_cache(self, params: list, fct: Callable) -> tuple:
+        """
+        Looks up the outputs of all iterations in the cache and restricts
+        params, in place, to the iterations which were not found. Returns
+        the callable storing the outputs as they are computed, the cached
+        outputs by iteration index, and the initial number of iterations
+        """
+        from ._cache import Cache, CacheWrite
+        token = Cache.fct_token(self._fct)
+        names = (len(params[0]),) + tuple(params[1].keys())
+        keys = []
+        for start in range(0, self.n, 10000):
+            keys += [Cache.key(token, names, row) for row in _rows(params, start, min(start + 10000, self.n))]
+        hits = {}
+        for j, key in enumerate(keys):
+            found, res = self.cache.get(key)
+            if found:
+                hits[j] = res
+        n = self.n
+        if hits and len(hits) < n:
+            missing = [j for j in range(n) if j not in hits]
+            for p, param in [(0, enumerate(params[0])), (1, params[1].items())]:
+                for idx, item in list(param):
+                    # split inputs, the others were wrapped into a fake 1-item list
+                    if len(item) == n:
+                        params[p][idx] = _Subset(item, missing)
+            keys = [keys[j] for j in missing]
+        self.n = n - len(hits)
+        if self.verbose:
+            print(f"Found {len(hits):d} iterations in the cache, will do {self.n:d}")
+        params[1]['_binge_key'] = keys
+        return CacheWrite(fct, self.cache), hits, n
+
+    def _to_grid(self, res):
+        """
+        With product, reshapes the stacked outputs along the axes of the grid
+        """
+        if not self._product or self.type_out not in ('nda', 'memmap') or self._reducer is not None or not hasattr(res, 'reshape'):
+            return res
+        return res.reshape(self._grid + res.shape[1:])
+
+    def _map_resilient(self, pool, wrap: Callable, tasks: list) -> list:
+        """
+        Same as _map_chunks, with timeouts, retries and speculative copies
+        of the tasks, and the failed iterations replaced by TaskError with
+        errors='return'
+        """
+        from ._resilient import run_tasks
+        outcomes, abandoned = run_tasks(pool, wrap, tasks, self.threads, self.timeout, self.retries,
+                                        self.speculative, stop=self.errors == 'raise')
+        self._abandoned = self._abandoned or abandoned
+        mapped_pool = []
+        for task, outcome in zip(tasks, outcomes):
+            if outcome is not None and outcome[0]:
+                mapped_pool += outcome[1]
+            elif outcome is not None and self.errors == 'return':
+                size = task[-1] - task[-2] if wrap is _wrap_range else len(task[-1])
+                # profiled outputs come with the records of the iterations, which failed
+                mapped_pool += [(outcome[1], []) if self._profile else outcome[1]] * size
+        if self.errors == 'raise':
+            for outcome in outcomes:
+                if outcome is not None and not outcome[0]:
+                    if self.verbose:
+                        print(f"Task failed after {outcome[1].attempts:d} attempts")
+                    raise outcome[1].error
+        return mapped_pool
+
+    def _post_process(self, mapped_pool: list):
+        """
+        Applies the type_out transformation to the gathered outputs, or
+        combines them with reduce
+        """
+        if self._reducer is not None:
+            return _tree_reduce(self._reducer, mapped_pool)
+        if self.type_out is None:
+            return mapped_pool
+        try:
+            if self.type_out == 'df':
+                from pandas import concat
+                return concat(mapped_pool, axis=0)
+            elif self.type_out == 'nd1' or (self.type_out == 'nda' and self.blocks is not None):
+                from numpy import concatenate
+                return concatenate(mapped_pool, axis=0)
+            elif self.type_out == 'nda':
+                from numpy import concatenate
+                return concatenate([[item] for item in mapped_pool], axis=0)
+            elif self.type_out == 'memmap':
+                from ._memmap import MemmapOutput
+                out = MemmapOutput(self.out_path, len(mapped_pool), mapped_pool[0], self._out_shape, self._out_dtype)
+                for j, item in enumerate(mapped_pool):
+                    out.array[j] = item
+                return out.result()
+            else:
+                raise Exception("Unkonwn typout '{}'".format(self.type_out))
+        except:
+            issue = traceback.format_exc()
+            print("Some error happened trying to post-process the output " +
+                  f"according to typout '{self.type_out}':\n{issue}\nReturned the raw output instead")
+        return mapped_pool
+
+    def _share_inputs(self, params: list) -> list:
+        """
+        Moves the ndarray inputs to be split into shared memory, in place,
+        and returns the shared memory splits to release after the call
+        """
+        from ._shm import ShmSplit, shareable
+        splits = []
         for p, param in [(0, enumerate(params[0])), (1, params[1].items())]:
             for idx, item in param:
-                if self._inspect_it(item):
-                    # this input is inspect-compatible
-                    if len(item) != self.n:
-                        # but its length is not the one we want to iterate on wrap it into a fake 1-item list
-                        params[p][idx] = [item]
-                else:
-                    # item not inspect-compatible
-                    # wrap it into a fake 1-item list
-                    if isinstance(item, types.GeneratorType):
-                        # can't pickle generators, so gotta force it into tuple
-                        item = tuple(item)
-                    params[p][idx] = [item]
-
-        # make the single parameter list for the pool
-        all_params = []
-        for j in range(self.n):
-            temp = [self._fct, len(params[0]), self._fwd_pinfo, self.threads]
-            for item in params[0]:
-                temp.append(item[min(j, len(item) - 1)])
-            for key, item in params[1].items():
-                temp.append((key, item[min(j, len(item) - 1)]))
-            all_params.append(temp)
-
-        del params, temp
-
-        with multiprocessing.Pool(processes=self.threads) as pool:
-            mapped_pool = pool.map(_wrap_fct, all_params)
+                # inputs which are not split were wrapped into a fake 1-item list
+                if isinstance(item, self.ndarray) and shareable(item):
+                    splits.append(ShmSplit(item))
+                    params[p][idx] = splits[-1]
+                elif isinstance(item, _Blocks) and isinstance(item.item, self.ndarray) and shareable(item.item):
+                    splits.append(ShmSplit(item.item, item.bounds))
+                    params[p][idx] = splits[-1]
+        return splits
+
+    def _share(self, params: list, fct: Callable, n: int or None, lazy: dict or None = None,
+               remote=None) -> tuple:
+        """
+        Moves the inputs to shared memory as requested, in place: the
+        ndarrays to be split with shm_in, and fct along with the inputs
+        which are the same for all of the n iterations with broadcast. The
+        row positions of the `lazy` generators are updated accordingly.
+        With a cluster pool `remote`, the broadcast inputs are stored on
+        its nodes instead. On a warm pool, the broadcast is kept until the
+        pool is closed, and re-used by the next calls if they broadcast
+        the same payload. Returns the callable to send to the workers
+        instead of fct, and the shared memory segments to release after
+        the call
+        """
+        splits = []
+        if self._broadcast is not False and (n is None or n > 1):
+            from ._broadcast import broadcast
+            lazy = {} if lazy is None else lazy
+            warm = self._pool is not None and (remote is self._pool if remote is not None else
+                                               self._pool_backend == 'process')
+            fct, bcast, removed = broadcast(fct, params, 0 if self._broadcast else _BROADCAST_SIZE, set(lazy),
+                                            self._serializer, remote, self._broadcasted if warm else None)
+            if bcast is not None:
+                if not warm:
+                    splits.append(bcast)
+                elif bcast is not self._broadcasted:
+                    if self._broadcasted is not None:
+                        self._broadcasted.release()
+                    self._broadcasted = bcast
+                for pos in sorted(lazy):
+                    lazy[pos - sum(1 for r in removed if r < pos)] = lazy.pop(pos)
+                if self.verbose:
+                    print(f"Broadcast {bcast.size:d} bytes of function and constant inputs")
+        if self._shm_in and remote is None:
+            from ._shm import ShmCall
+            shm_splits = self._share_inputs(params)
+            if shm_splits:
+                fct = ShmCall(fct)
+                splits += shm_splits
+        return fct, splits
+
+    def _run_out(self, pool, params: list, fct: Callable) -> tuple:
+        """
+        Preallocates the output ndarray in shared memory, or in a file with
+        type_out='memmap', from out_shape and out_dtype or else from the
+        output of the first iteration, and has the workers write their
+        output straight into it
+        """
+        if self._memmap:
+            from ._memmap import MemmapOutput as Output, MemmapWrite as Write
+            new_output = functools.partial(Output, self.out_path)
+        else:
+            from ._shm import ShmOutput as Output, ShmWrite as Write
+            new_output = Output
+        start = 0
+        if self._out_shape is None or self._out_dtype is None:
+            head = (fct, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads)
+            first = pool.apply(_wrap_chunk, (head + (_rows(params, 0, 1),),))[0]
+            out = new_output(self.n, first, self._out_shape, self._out_dtype)
+            out.array[0] = first
+            start = 1
+        else:
+            out = new_output(self.n, None, self._out_shape, self._out_dtype)
+        try:
+            # workers need to know which slot to write to, inherited inputs get it from their range
+            if self._token is None:
+                params[1]['_binge_index'] = range(self.n)
+            self._run(pool, params, Write(fct, out), start)
+        except:
+            out.release()
+            raise
+        return out
+
+    def _open_stream(self, args: tuple, kwargs: dict) -> tuple:
+        """
+        Prepares the inputs for streaming, and returns the task header,
+        an iterator over the chunks of rows, and the shared memory splits
+        to release when done
+        """
+        params, lazy, n = self._prepare_lazy(args, kwargs)
+        fct = self._task_fct()
+        splits = []
+        if self._pool_backend == 'process':
+            fct, splits = self._share(params, fct, n, lazy)
+        chunksize = self.chunksize if isinstance(self.chunksize, int) else 1
+        head = (fct, len(params[0]), tuple(params[1].keys()), self._fwd_pinfo, self.threads)
+        rows = self._lazy_rows(params, lazy, n)
+        return head, iter(lambda: list(itertools.islice(rows, chunksize)), []), splits
+
+    def _stream(self, args: tuple, kwargs: dict, ordered: bool) -> Iterable:
+        """
+        Sends tasks to the pool as workers free up, keeping at most
+        `inflight` of them pending, and yields the outputs as they come
+        """
+        head, chunks, splits = self._open_stream(args, kwargs)
+        self._warn_by_label()
+        pool, temporary = self._get_pool()
+        run_pool = self._serializing(pool)
+        try:
+            if ordered:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(run_pool.apply_async(_wrap_chunk, (head + (chunk,),)))
+                    if len(pending) >= self.inflight:
+                        yield from pending.popleft().get()
+                while pending:
+                    yield from pending.popleft().get()
+            else:
+                done = queue.Queue()
+                n_pending = 0
+                exhausted = False
+                while True:
+                    while not exhausted and n_pending < self.inflight:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        run_pool.apply_async(_wrap_chunk, (head + (chunk,),),
+                                             callback=lambda res: done.put((True, res)),
+                                             error_callback=lambda err: done.put((False, err)))
+                        n_pending += 1
+                    if n_pending == 0:
+                        break
+                    ok, res = done.get()
+                    n_pending -= 1
+                    if not ok:
+                        raise res
+                    yield from res
+        finally:
+            if temporary:
+                pool.terminate()
+            self._release_serialized(run_pool, pool)
+            if splits:
+                from ._shm import release_all
+                release_all(splits)
+
+    async def _astream(self, args: tuple, kwargs: dict, ordered: bool) -> AsyncIterator:
+        """
+        Same as _stream, but awaits the outputs without blocking the event
+        loop. No more tasks are running than the pool has workers, so
+        that none waits in the queue of the pool: if cancelled, the tasks
+        which were not sent yet never will be, and only the running ones
+        complete, their outputs being dropped
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        opening = loop.run_in_executor(None, self._open_stream, args, kwargs)
+        try:
+            head, chunks, splits = await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            # the shared memory of inputs still being prepared is freed once they are
+            opening.add_done_callback(_release_opened)
+            raise
+        self._warn_by_label()
+        pool, temporary = await loop.run_in_executor(None, self._get_pool)
+        run_pool = self._serializing(pool)
+        workers = max(1, getattr(pool, '_processes', None) or 1)
+        pending = deque()
+
+        def submit(chunk):
+            fut = loop.create_future()
+            run_pool.apply_async(_wrap_chunk, (head + (chunk,),),
+                                 callback=lambda res: loop.call_soon_threadsafe(_set_future, fut, True, res),
+                                 error_callback=lambda err: loop.call_soon_threadsafe(_set_future, fut, False, err))
+            pending.append(fut)
+
+        try:
+            exhausted = False
+            while True:
+                while (not exhausted and len(pending) < self.inflight and
+                       sum(not fut.done() for fut in pending) < workers):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                    else:
+                        submit(chunk)
+                if not pending:
+                    break
+                running = [fut for fut in pending if not fut.done()]
+                if (pending[0] in running) if ordered else (len(running) == len(pending)):
+                    # also wakes up when any task completes, to send the next one
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                done = [fut for fut in itertools.takewhile(asyncio.Future.done, pending)] if ordered else \
+                    [fut for fut in pending if fut.done()]
+                for fut in done:
+                    pending.remove(fut)
+                    for res in fut.result():
+                        yield res
+        finally:
+            for fut in pending:
+                fut.cancel()
+            if temporary:
+                pool.terminate()
+            self._release_serialized(run_pool, pool)
+            if splits:
+                from ._shm import release_all
+                release_all(splits)
+
+    def imap(self, *args, **kwargs) -> Iterable:
+        """
+        Same as calling B, but returns an iterator which yields the outputs
+        in order as they come, consuming generator inputs lazily with at
+        most `inflight` tasks pending. type_out is ignored
+        """
+        return self._stream(args, kwargs, ordered=True)
+
+    def imap_unordered(self, *args, **kwargs) -> Iterable:
+        """
+        Same as imap, but yields the outputs in completion order
+        """
+        return self._stream(args, kwargs, ordered=False)
+
+    def _search(self, pred: Callable, args: tuple, kwargs: dict) -> tuple or None:
+        """
+        Sends tasks to the pool as workers free up, keeping at most
+        `inflight` of them pending, until one output satisfies pred. Then
+        no more task is sent, and the workers still busy are stopped if
+        the pool is a temporary one. Returns the index and output of the
+        hit, or None
+        """
+        head, chunks, splits = self._open_stream(args, kwargs)
+        self._warn_by_label()
+        backend = self._pool_backend
+        if self._shared and self._pool is None and backend == 'process':
+            # the busy workers of a shared pool could not be stopped without stopping it for the other users
+            pool, temporary = new_pool(self.threads, backend, self.nodes, self._authkey, self._start_method,
+                                       self._preload), True
+        else:
+            pool, temporary = self._get_pool()
+        run_pool = self._serializing(pool)
+        done = queue.Queue()
+        n_pending = 0
+        start = 0
+        found = None
+        exhausted = False
+        try:
+            while found is None:
+                while not exhausted and n_pending < self.inflight:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    run_pool.apply_async(_search_chunk, ((pred, head, start, chunk),),
+                                         callback=lambda res: done.put((True, res)),
+                                         error_callback=lambda err: done.put((False, err)))
+                    start += len(chunk)
+                    n_pending += 1
+                if n_pending == 0:
+                    break
+                ok, found = done.get()
+                n_pending -= 1
+                if not ok:
+                    raise found
+        finally:
+            if temporary and backend == 'thread':
+                # threads cannot be killed, they end on their own once done
+                pool.close()
+            elif temporary:
+                pool.terminate()
+            # the tasks still pending on a warm or shared pool complete on their own, their outputs being dropped
+            self._release_serialized(run_pool, pool)
+            if splits:
+                from ._shm import release_all
+                release_all(splits)
+        return found
+
+    def first(self, pred: Callable or None, *args, **kwargs) -> tuple or None:
+        """
+        Same as calling B, but returns as soon as the output of an
+        iteration satisfies pred, as the tuple of its index and output,
+        or None if none does. The iterations are sent in order, by
+        chunks of chunksize if it is an int, and checked in completion
+        order, so the hit is not necessarily the one of lowest index.
+        Iterations not yet sent never are, and the workers still busy
+        are stopped, so the run time follows the position of the hit
+        rather than n. On a warm pool, or a shared thread pool, the busy
+        workers finish their tasks instead, at most `inflight` of them,
+        and searches with shared=True and the process backend run on
+        their own pool so as to stop it. Generator inputs are consumed lazily, and may be
+        infinite. pred runs in the workers: it must be picklable with the
+        process backend. None means the truth value of the output
+        """
+        return self._search(bool if pred is None else pred, args, kwargs)
+
+    def any(self, *args, **kwargs) -> bool:
+        """
+        Same as calling B, but returns whether any output is true,
+        stopping at the first one as with first
+        """
+        return self._search(bool, args, kwargs) is not None
+
+    def all(self, *args, **kwargs) -> bool:
+        """
+        Same as calling B, but returns whether all outputs are true,
+        stopping at the first false one as with first
+        """
+        return self._search(operator.not_, args, kwargs) is None
+
+    def aimap(self, *args, **kwargs) -> AsyncIterator:
+        """
+        Same as imap, but returns an asynchronous iterator to use with
+        `async for` from within an event loop
+        """
+        return self._astream(args, kwargs, ordered=True)
+
+    def aimap_unordered(self, *args, **kwargs) -> AsyncIterator:
+        """
+        Same as imap_unordered, but returns an asynchronous iterator to use
+        with `async for` from within an event loop
+        """
+        return self._astream(args, kwargs, ordered=False)
+
+    async def acall(self, *args, **kwargs):
+        """
+        Same as aimap, but awaitable and returns all outputs like a call,
+        so that the event loop keeps running while the workers are busy.
+        Cancelling it cancels the tasks which are not running yet, none
+        being queued in the pool. As with imap, iterations are sent one
+        per task, or by chunks of chunksize if it is an int, and cache is
+        ignored. timeout, retries, speculative, errors='return', stats,
+        on_task_start and on_task_end are only supported by calls, and
+        raise a ValueError
+        """
+        if self._resilient or self._profile:
+            raise ValueError("timeout, retries, speculative, errors='return', stats, on_task_start and "
+                             "on_task_end can't be combined with acall")
+        stream = self._astream(args, kwargs, ordered=True)
+        try:
+            mapped_pool = [res async for res in stream]
+        finally:
+            await stream.aclose()
+        return self._to_grid(self._post_process(mapped_pool))
+
+    def _phase(self, name: str):
+        """
+        Context manager timing the phase `name` of a call, if requested
+        """
+        return self.stats.phase(name) if self._profile else nullcontext()
+
+    def __or__(self, other):
+        """
+        Chains the stages into a binge.Pipeline
+        """
+        from ._pipeline import Pipeline
+        return Pipeline(self, other)
+
+    def __ror__(self, other):
+        from ._pipeline import Pipeline
+        return Pipeline(other, self)
+
+    def __call__(self, *args, **kwargs):
+        if self._profile:
+            from ._stats import Stats
+            self.stats = Stats()
+        with self._phase('total'):
+            return self._call(args, kwargs)
+
+    def _call(self, args: tuple, kwargs: dict):
+        with self._phase('prepare'):
+            params = self._prepare(args, kwargs)
+        self._warn_by_label()
+        fct = self._task_fct()
+        splits = []
+        out = None
+        hits = None
+        mapped_pool = []
+        try:
+            if self.cache is not None:
+                with self._phase('cache'):
+                    fct, hits, n = self._use_cache(params, fct)
+                if not self.n:
+                    return self._to_grid(self._post_process([hits[j] for j in range(n)]))
+            backend = self.backend
+            if backend == 'auto' and (self._shm_out or self._memmap):
+                backend = 'process'
+            elif backend == 'auto':
+                with self._phase('backend'):
+                    backend, mapped_pool = self._pick_backend(params, fct)
+                if self.verbose:
+                    print(f"Will use backend '{backend}'")
+            if self._inherits(backend):
+                # must be in place before the workers are forked
+                self._token = next(_TOKENS)
+                _INHERITED[self._token] = params
+            # shared memory is only worth it across processes
+            elif backend == 'process':
+                with self._phase('share'):
+                    fct, splits = self._share(params, fct, self.n)
+            with self._phase('pool'):
+                pool, temporary = self._get_pool(backend)
+            self._abandoned = False
+            run_pool = pool
+            try:
+                if backend == 'cluster':
+                    if self.verbose:
+                        print(f"Will use nodes {', '.join(f'{host} ({threads:d} workers)' for host, threads in pool.nodes)}")
+                    with self._phase('share'):
+                        fct, splits = self._share(params, fct, self.n, remote=pool)
+                with self._phase('run'):
+                    run_pool = self._serializing(pool, backend)
+                    if self._memmap or (self._shm_out and backend == 'process'):
+                        out = self._run_out(run_pool, params, fct)
+                    else:
+                        mapped_pool += self._run(run_pool, params, fct, len(mapped_pool))
+            finally:
+                if backend == 'thread' and (temporary or self._abandoned):
+                    # threads cannot be killed, they end on their own once done
+                    pool.close()
+                elif self._abandoned or temporary:
+                    # tasks which timed out must not hold the workers of a warm pool
+                    pool.terminate()
+                self._release_serialized(run_pool, pool)
+        finally:
+            if splits:
+                from ._shm import release_all
+                release_all(splits)
+            if self._token is not None:
+                del _INHERITED[self._token]
+                self._token = None
+            if self.cache is not None:
+                self.cache.evict()
             # back to initial instruction
             self.n = self._n if self._n is not None else 1
-            if self.type_out is None:
-                return mapped_pool
-            try:
-                if self.type_out == 'df':
-                    from pandas import DataFrame
-                    from numpy import vstack
-                    return DataFrame(vstack(mapped_pool), columns=mapped_pool[0].columns)
-                elif self.type_out == 'nd1':
-                    from numpy import concatenate
-                    return concatenate(mapped_pool, axis=0)
-                elif self.type_out == 'nda':
-                    from numpy import concatenate
-                    return concatenate([[item] for item in mapped_pool], axis=0)
-                else:
-                    raise Exception("Unkonwn typout '{}'".format(self.type_out))
-            except:
-                issue = traceback.format_exc()
-                print("Some error happened trying to post-process the output " +
-                      f"according to typout '{self.type_out}':\n{issue}\nReturned the raw output instead")
-            return mapped_pool
+        with self._phase('post_process'):
+            if out is not None:
+                return self._to_grid(out.result(stack=self.type_out == 'nd1'))
+            if hits is not None:
+                computed = iter(mapped_pool)
+                mapped_pool = [hits[j] if j in hits else next(computed) for j in range(n)]
+            return self._to_grid(self._post_process(mapped_pool))
 
 def dum(a):
     return a+1
@@ -0,0 +1,438 @@
+###############################################################################
+#
+#  BINGE - Lazy multiprocess your callables in three extra characters
+#  Copyright (C) 2018  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+"""
+Multi-node backend: worker servers run the tasks of B(f, backend='cluster',
+nodes=[...]) sent to them over TCP.
+
+Start a worker server on each node with:
+> BINGE_AUTHKEY=secret python -m binge.cluster --host 0.0.0.0 --port 5000 --threads 8
+and call from anywhere which reaches them:
+> B(f, backend='cluster', nodes=['node1:5000', 'node2:5000'], authkey='secret')(inputs)
+
+fct and its inputs must be importable and picklable on the nodes. The
+tasks and outputs are pickles, which the nodes run: only use the cluster
+backend on a trusted network, with a secret authkey, given as argument or
+with the BINGE_AUTHKEY environment variable. Without one, servers only
+listen on, and clients only connect to, the loopback interface
+"""
+
+from __future__ import annotations
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Callable
+
+import argparse
+import ipaddress
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
+import pickle
+import socket
+import threading
+import uuid
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+from ._broadcast import Broadcast, install_remote
+from ._pools import new_pool
+
+
+# how many tasks each node is sent ahead per worker, to hide the network latency
+_PREFETCH: int = 2
+
+
+def _loopback(host: str) -> bool:
+    """
+    Whether `host` resolves to the loopback interface
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def _authkey(authkey: bytes or str or None, hosts: list) -> bytes:
+    """
+    Returns the secret shared by the clients and servers: `authkey`, else
+    the BINGE_AUTHKEY environment variable. Without either, the public
+    default 'binge' is only allowed if all `hosts` are loopback, as
+    anyone knowing the key can run code on the servers
+    """
+    if authkey is None:
+        authkey = os.environ.get('BINGE_AUTHKEY')
+    if authkey is None:
+        if not all(_loopback(host) for host in hosts):
+            raise ValueError("an authkey, or the BINGE_AUTHKEY environment variable, is required "
+                             "beyond the loopback interface")
+        authkey = 'binge'
+    return authkey.encode() if isinstance(authkey, str) else bytes(authkey)
+
+
+def _address(node) -> tuple:
+    """
+    Returns the (host, port) of a node given as such or as 'host:port'
+    """
+    if isinstance(node, str):
+        host, port = node.rsplit(':', 1)
+        return host, int(port)
+    return tuple(node)
+
+
+def _run_task(params):
+    """
+    Runs a pickled task in a worker of a node, with the broadcast data
+    stored on the node, and returns its pickled output
+    """
+    data, task = params
+    install_remote(data)
+    fct, args, kwds = pickle.loads(task)
+    return pickle.dumps(fct(*args, **kwds), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _dumps_error(err: BaseException) -> bytes:
+    """
+    Pickles the exception raised by a task, or a RuntimeError describing
+    it if it cannot be pickled
+    """
+    try:
+        return pickle.dumps(err, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return pickle.dumps(RuntimeError(f"{type(err).__name__}: {err}"), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _session(conn, pool, threads: int) -> None:
+    """
+    Serves one client: registers the node to it, runs its tasks on the
+    pool and sends their outputs back as they complete
+    """
+    lock = threading.Lock()
+    data = {}
+
+    def reply(msg) -> None:
+        with lock:
+            try:
+                conn.send(msg)
+            except (OSError, EOFError):
+                # client gone, its outputs are dropped
+                pass
+
+    reply(('hello', threads, socket.gethostname()))
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == 'task':
+                _, tid, task = msg
+                stored = {key: (bcast.shm.name, bcast.size) for key, bcast in data.items()}
+                pool.apply_async(_run_task, ((stored, task),),
+                                 callback=lambda res, tid=tid: reply(('result', tid, True, res)),
+                                 error_callback=lambda err, tid=tid: reply(('result', tid, False, _dumps_error(err))))
+            elif msg[0] == 'put':
+                # broadcast data is stored once per node, in its shared memory
+                data[msg[1]] = Broadcast(msg[2])
+            elif msg[0] == 'drop' and msg[1] in data:
+                data.pop(msg[1]).release()
+            elif msg[0] == 'close':
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        for bcast in data.values():
+            bcast.release()
+        conn.close()
+
+
+def serve(address: tuple = ('127.0.0.1', 5000), threads: int or None = None, authkey: bytes or str or None = None,
+          ready=None) -> None:
+    """
+    Runs a worker server forever, which runs the tasks sent by B with
+    backend='cluster' on a pool of `threads` processes
+
+    Args:
+      * address (tuple): the (host, port) to listen on, port 0 picks a
+        free port
+      * threads (int or None): the number of worker processes. None means
+        use all CPUs
+      * authkey (bytes or str or None): the secret shared with the
+        clients. None means the BINGE_AUTHKEY environment variable, which
+        is required unless listening on the loopback interface
+      * ready (queue or None): if given, the address listened on is put
+        into it once the server accepts clients
+    """
+    authkey = _authkey(authkey, [address[0]])
+    threads = multiprocessing.cpu_count() if threads is None else int(threads)
+    pool = new_pool(threads, 'process')
+    with Listener(tuple(address), authkey=authkey) as listener:
+        if ready is not None:
+            ready.put(listener.address)
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                # a client which failed its handshake
+                continue
+            threading.Thread(target=_session, args=(conn, pool, threads), daemon=True).start()
+
+
+class _ClusterResult(object):
+    """
+    Outcome of a task sent to a node, with the AsyncResult interface
+    """
+
+    def __init__(self, callback: Callable or None, error_callback: Callable or None):
+        self._callback: Callable or None = callback
+        self._error_callback: Callable or None = error_callback
+        self._event = threading.Event()
+        self._ok: bool = False
+        self._value = None
+        self.node: _Node or None = None
+
+    def _set(self, ok: bool, value) -> None:
+        self._ok = ok
+        self._value = value
+        if ok and self._callback is not None:
+            self._callback(value)
+        elif not ok and self._error_callback is not None:
+            self._error_callback(value)
+        self._event.set()
+
+    def ready(self) -> bool:
+        return self._event.is_set()
+
+    def successful(self) -> bool:
+        return self._ok
+
+    def wait(self, timeout: float or None = None) -> None:
+        self._event.wait(timeout)
+
+    def get(self, timeout: float or None = None):
+        if not self._event.wait(timeout):
+            raise multiprocessing.TimeoutError
+        if not self._ok:
+            raise self._value
+        return self._value
+
+
+class _Node(object):
+    """
+    Connection to a worker server, and the tasks it is running
+    """
+
+    def __init__(self, address: tuple, authkey: bytes):
+        self.address: tuple = address
+        self.conn = Client(address, authkey=authkey)
+        _, self.threads, self.host = self.conn.recv()
+        self.running: set = set()
+        self.alive: bool = True
+
+
+class ClusterPool(object):
+    """
+    Pool look-alike which sends the tasks to worker servers over TCP,
+    keeping each node busy in proportion to its number of workers. The
+    nodes register their number of workers on connection, those which
+    cannot be reached are left out
+
+    Args:
+      * nodes (list): the addresses of the worker servers, as (host, port)
+        or 'host:port'
+      * authkey (bytes or str or None): the secret shared with the servers.
+        None means the BINGE_AUTHKEY environment variable, which is required
+        unless all nodes are on the loopback interface
+    """
+
+    def __init__(self, nodes: list, authkey: bytes or str or None = None):
+        addresses = [_address(node) for node in nodes]
+        authkey = _authkey(authkey, [host for host, _ in addresses])
+        self._nodes: list = []
+        for address in addresses:
+            # the nodes which cannot be reached are left out
+            try:
+                self._nodes.append(_Node(address, authkey))
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                pass
+        if not self._nodes:
+            raise ConnectionError(f"could not reach any of the nodes {nodes}")
+        self._processes: int = sum(node.threads for node in self._nodes)
+        self._state: str = multiprocessing.pool.RUN
+        self._binge_pids = None
+        self._lock = threading.RLock()
+        self._results: dict = {}
+        self._pending = deque()
+        self._ids = itertools.count()
+        self._receivers: list = [threading.Thread(target=self._receive, args=(node,), daemon=True)
+                                 for node in self._nodes]
+        for receiver in self._receivers:
+            receiver.start()
+
+    @property
+    def nodes(self) -> list:
+        """
+        The host and number of workers of each node still connected
+        """
+        return [(node.host, node.threads) for node in self._nodes if node.alive]
+
+    def _receive(self, node: _Node) -> None:
+        """
+        Collects the outputs sent back by `node` until it disconnects
+        """
+        try:
+            while True:
+                _, tid, ok, value = node.conn.recv()
+                with self._lock:
+                    res = self._results.pop(tid, None)
+                    node.running.discard(tid)
+                    self._dispatch()
+                if res is None:
+                    continue
+                try:
+                    value = pickle.loads(value)
+                except Exception as err:
+                    # e.g. the output of a class which the client cannot import, only this task fails
+                    ok, value = False, err
+                res._set(ok, value)
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            # only closed here, as its file descriptor could be re-used while still read
+            node.conn.close()
+            node.alive = False
+            lost = [self._results.pop(tid) for tid in node.running if tid in self._results]
+            node.running.clear()
+            if not any(node.alive for node in self._nodes):
+                # a warm pool with no node left is re-created on the next call
+                self._state = multiprocessing.pool.CLOSE
+                lost += [res for _, _, res in self._pending]
+                self._pending.clear()
+            self._dispatch()
+        for res in lost:
+            res._set(False, ConnectionError(f"lost node {node.address[0]}:{node.address[1]}"))
+
+    def _dispatch(self) -> None:
+        """
+        Sends the pending tasks to the least busy nodes which have room
+        for them. Must be called with the lock held
+        """
+        while self._pending:
+            nodes = [node for node in self._nodes if node.alive and len(node.running) < _PREFETCH * node.threads]
+            if not nodes:
+                return
+            node = min(nodes, key=lambda node: len(node.running) / node.threads)
+            tid, task, res = self._pending.popleft()
+            res.node = node
+            node.running.add(tid)
+            try:
+                node.conn.send(('task', tid, task))
+            except (OSError, EOFError):
+                # the receiver of the node fails its tasks
+                node.alive = False
+
+    def apply_async(self, fct, args=(), kwds={}, callback=None, error_callback=None) -> _ClusterResult:
+        task = pickle.dumps((fct, args, kwds), protocol=pickle.HIGHEST_PROTOCOL)
+        res = _ClusterResult(callback, error_callback)
+        with self._lock:
+            if not any(node.alive for node in self._nodes):
+                raise ConnectionError("no node left")
+            tid = next(self._ids)
+            self._results[tid] = res
+            self._pending.append((tid, task, res))
+            self._dispatch()
+        return res
+
+    def apply(self, fct, args=(), kwds={}):
+        return self.apply_async(fct, args, kwds).get()
+
+    def map(self, fct, iterable, chunksize=None) -> list:
+        return [res.get() for res in [self.apply_async(fct, (item,)) for item in iterable]]
+
+    def put(self, payload: bytes) -> str:
+        """
+        Stores `payload` once on each node and returns its key
+        """
+        key = uuid.uuid4().hex
+        with self._lock:
+            for node in self._nodes:
+                if node.alive:
+                    try:
+                        node.conn.send(('put', key, payload))
+                    except (OSError, EOFError):
+                        # the receiver of the node fails its tasks
+                        node.alive = False
+        return key
+
+    def drop(self, key: str) -> None:
+        """
+        Frees the payload stored under `key` on the nodes
+        """
+        with self._lock:
+            for node in self._nodes:
+                if node.alive and self._state == multiprocessing.pool.RUN:
+                    try:
+                        node.conn.send(('drop', key))
+                    except (OSError, EOFError):
+                        pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self._state != multiprocessing.pool.RUN:
+                return
+            self._state = multiprocessing.pool.CLOSE
+            for node in self._nodes:
+                try:
+                    node.conn.send(('close',))
+                except (OSError, EOFError):
+                    pass
+
+    def terminate(self) -> None:
+        self.close()
+        self._state = multiprocessing.pool.TERMINATE
+        with self._lock:
+            for node in self._nodes:
+                # wakes up the receiver of the node, which closes the connection
+                try:
+                    with socket.socket(fileno=os.dup(node.conn.fileno())) as sock:
+                        sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def join(self) -> None:
+        for receiver in self._receivers:
+            receiver.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a binge worker server")
+    parser.add_argument('--host', default='127.0.0.1', help="the interface to listen on")
+    parser.add_argument('--port', type=int, default=5000, help="the port to listen on")
+    parser.add_argument('--threads', type=int, default=None, help="the number of worker processes")
+    parser.add_argument('--authkey', default=None, help="the secret shared with the clients, else "
+                                                        "BINGE_AUTHKEY, required beyond the loopback interface")
+    args = parser.parse_args()
+    try:
+        authkey = _authkey(args.authkey, [args.host])
+    except ValueError as err:
+        parser.error(str(err))
+    print(f"binge worker server listening on {args.host}:{args.port}")
+    serve((args.host, args.port), args.threads, authkey)
@@ -49,6 +49,14 @@ r == r2
 # This approach will become interesting when the processing of the
 # data is not a simple operation such as sum
 
+# giving shm_in=True copies the array once into shared memory, and each
+# process gets a read-only view on its slice instead of a pickled copy
+r3 = B(np.sum, type_in='nda', type_out='nda', shm_in=True)(data)
+
+# giving blocks=True cuts the array into one contiguous block per process
+# and calls np.sum once per block, so it stays vectorized
+r4 = B(np.sum, type_in='nda', type_out='nd1', blocks=True)(data, axis=(1, 2))
+
 
 ################################################################################
 # working with generators
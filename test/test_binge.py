@@ -1,10 +1,28 @@
 from unittest import TestCase
+import asyncio
+import functools
+import contextlib
+import gc
+import io
+import itertools
+import json
+import multiprocessing
+import tempfile
 import numpy as np
+import operator
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import threading
 import time
+import warnings
 import pandas as pd
 
-from binge import B
+from binge import B, Pipeline, TaskError, register_serializer, shared_pool, close_shared_pools
 from binge.binge import _wrap_fct
+from binge.cluster import serve
 
 
 def dummy_wrap(a, b, _pinfo):
@@ -28,11 +46,173 @@ def dummy2(a, b=1):
     return a + b
 
 
+def dum_tag(a, b):
+    return a, b
+
+
 def dummy_wait(a):
     time.sleep(1)
     return a
 
 
+def dum_pid(a):
+    return os.getpid()
+
+
+def dum_writeable(a):
+    return a.flags.writeable
+
+
+def dum_spin(a):
+    return a + sum(range(1000000)) * 0
+
+
+def dum_rowsum(a, w=1):
+    return a.sum(axis=1) * w
+
+
+def dum_group(df, scale=1):
+    return pd.DataFrame({'key': [df['key'].iloc[0]], 'total': [df['val'].sum() * scale]})
+
+
+def dum_log(record, path):
+    with open(path, 'a') as f:
+        f.write(f"{record['index']}\n")
+
+
+def dum_table(a, table, b=0, scale=1):
+    return (table[a] + b) * scale
+
+
+def dum_apply(x, g):
+    return g(x)
+
+
+def dum_init(state):
+    state['pid'] = os.getpid()
+    state['count'] = 0
+
+
+def dum_state(a, _state):
+    _state['count'] += 1
+    return _state['pid'], _state['count']
+
+
+def dum_fail(a):
+    if str(a) == os.environ.get('BINGE_TEST_FAIL'):
+        raise ValueError(a)
+    return os.getpid(), a
+
+
+def dum_fail_zero(a):
+    if a[0] == 0:
+        raise ValueError(a[0])
+    time.sleep(0.05)
+    return a
+
+
+def dum_once(a, path, sleep=0.):
+    # fails, or sleeps, on the first attempt only
+    marker = os.path.join(path, str(a))
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        if not sleep:
+            raise ValueError(a)
+        time.sleep(sleep)
+    return a
+
+
+def dum_dumps(obj):
+    return b'dum' + pickle.dumps(obj)
+
+
+def dum_loads(data):
+    assert bytes(data[:3]) == b'dum'
+    return pickle.loads(data[3:])
+
+
+def dum_node(a, b):
+    return a + len(b), os.getppid()
+
+
+def dum_shm_maps(a=None):
+    with open('/proc/self/maps') as f:
+        return {word for line in f for word in line.split() if '/psm_' in word}
+
+
+_VIEWS = []
+_LOADS = [0]
+
+
+class DumBig(object):
+    def __init__(self):
+        self.data = 'x' * 100000
+
+    def __setstate__(self, state):
+        _LOADS[0] += 1
+        self.__dict__.update(state)
+
+
+def dum_big_loads(a, big):
+    return _LOADS[0]
+
+
+
+
+def dum_view(a):
+    # kept alive for the ids to be unique
+    _VIEWS.append(a.base.base)
+    return id(_VIEWS[-1])
+
+
+def dum_maps(a=None):
+    with open('/proc/self/maps') as f:
+        return f.read()
+
+
+def dum_load_fail(a):
+    raise ValueError(a)
+
+
+class DumUnloadable(object):
+    # pickles fine, but fails to load
+    def __reduce__(self):
+        return dum_load_fail, ('unloadable',)
+
+
+def dum_unloadable(a):
+    if a == 1:
+        return DumUnloadable()
+    if a == 2:
+        raise ValueError(threading.Lock())
+    return a
+
+
+def dum_pinned(a):
+    return sorted(os.sched_getaffinity(0)), os.environ.get('OMP_NUM_THREADS')
+
+
+def dum_loaded(module):
+    return module in sys.modules
+
+
+def dum_tag_pid(a):
+    return a, os.getpid()
+
+
+def dum_same(res):
+    return res[0], res[1] == os.getpid()
+
+
+def dum_big(a):
+    return a > 5
+
+
+def dum_search(a):
+    time.sleep(0.1)
+    return a == 3
+
+
 def dummy_pd(x, col):
     return pd.DataFrame([{col: x}])
 
@@ -198,3 +378,686 @@ class TestPlay(TestCase):
         b = [1, 2]
         res = B(dum_n, n=2)(a, b)
         self.assertEqual(res, [sum(a)*i for i in b])
+
+    def test_context_pool(self):
+        with B(dum_pid, threads=2) as bf:
+            pids = set(bf(range(4)))
+            pids2 = set(bf(range(4)))
+        self.assertTrue(len(pids | pids2) <= 2)
+        self.assertIsNone(bf._pool)
+    
+    def test_start_close(self):
+        bf = B(dummy, threads=2).start()
+        pool = bf._pool
+        self.assertEqual(bf([1, 2]), [1, 2])
+        self.assertIs(bf._pool, pool)
+        bf.close()
+        self.assertIsNone(bf._pool)
+        # still works without warm pool
+        self.assertEqual(bf([1, 2]), [1, 2])
+    
+    def test_respawn(self):
+        with B(dum_pid, threads=2) as bf:
+            pids = set(bf(range(4)))
+            os.kill(bf._pool._pool[0].pid, signal.SIGKILL)
+            bf._pool._pool[0].join()
+            pids2 = set(bf(range(4)))
+        self.assertTrue(len(pids2 - pids) > 0)
+    
+    def test_shared_pool(self):
+        pool = shared_pool(2)
+        self.assertEqual(B(dummy, threads=2, shared=True)([1, 2]), [1, 2])
+        self.assertIs(shared_pool(2), pool)
+        close_shared_pools()
+        self.assertIsNot(shared_pool(2), pool)
+        close_shared_pools()
+
+    def test_chunksize(self):
+        li = list(range(10))
+        res = B(dummy2, chunksize=3, threads=2)(li, b=[1] * 10)
+        self.assertEqual([i + 1 for i in li], res)
+    
+    def test_chunksize_auto(self):
+        li = list(range(1000))
+        res = B(dummy2, chunksize='auto', threads=2)(li)
+        self.assertEqual([i + 1 for i in li], res)
+    
+    def test_chunksize_pinfo(self):
+        res = B(dummy_wrap, fwd_pinfo=True, chunksize=2, threads=2)([1, 2, 3], b=1)
+        self.assertEqual(res, [2, 3, 4])
+    
+    def test_bad_chunksize(self):
+        with self.assertRaises(ValueError):
+            B(dummy, chunksize=0)
+
+    def test_shm_in(self):
+        li = np.arange(12.).reshape(4, 3)
+        res = B(dummy, type_in='nda', type_out='nda', shm_in=True)(li)
+        self.assertTrue(np.all(li == res))
+    
+    def test_shm_in_chunksize(self):
+        li = np.arange(12).reshape(6, 2)
+        res = B(dum_n, type_in='nda', shm_in=True, chunksize=2, threads=2)(li, b=[1, 2, 3, 4, 5, 6])
+        self.assertEqual(res, [sum(row) * b for row, b in zip(li, range(1, 7))])
+    
+    def test_shm_in_readonly(self):
+        li = np.ones((2, 2))
+        res = B(dum_writeable, type_in='nda', shm_in=True)(li)
+        self.assertEqual(res, [False, False])
+
+    def test_shm_in_detached(self):
+        if not os.path.exists('/proc/self/maps'):
+            self.skipTest("needs /proc")
+        # warm workers do not keep the inputs of past calls mapped
+        with B(dum_shm_maps, type_in='nda', shm_in=True, threads=2) as b:
+            inputs = set().union(*b(np.ones((4, 1000)))) - dum_shm_maps()
+            self.assertTrue(inputs)
+            self.assertFalse(inputs.intersection(set().union(*b._pool.map(dum_shm_maps, range(4)))))
+        # a task attaches the segment once for all its iterations
+        res = B(dum_view, type_in='nda', shm_in=True, threads=2, chunksize=4)(np.ones((8, 10)))
+        self.assertEqual([len(set(res[:4])), len(set(res[4:]))], [1, 1])
+
+    def test_shm_out_nda(self):
+        li = np.arange(12.).reshape(4, 3)
+        res = B(dummy, type_in='nda', type_out='nda', shm_out=True)(li)
+        self.assertTrue(np.all(li == res))
+        if os.path.exists('/proc/self/maps'):
+            # the output is unmapped once garbage collected
+            before = dum_shm_maps()
+            res = B(dummy, type_in='nda', type_out='nda', shm_out=True)(li)
+            mapped = dum_shm_maps() - before
+            self.assertEqual(len(mapped), 1)
+            del res
+            gc.collect()
+            self.assertFalse(mapped & dum_shm_maps())
+    
+    def test_shm_out_nd1(self):
+        li = np.arange(12).reshape(6, 2)
+        res = B(dummy, type_in='nda', type_out='nd1', shm_out=True, shm_in=True, chunksize=2)(li)
+        self.assertTrue(np.all(li.ravel() == res))
+    
+    def test_shm_out_shape(self):
+        li = np.arange(12.).reshape(4, 3)
+        res = B(dummy, type_in='nda', type_out='nda', shm_out=True, out_shape=(3,), out_dtype='f4')(li)
+        self.assertEqual(res.dtype, np.float32)
+        self.assertTrue(np.all(li == res))
+
+    def test_imap(self):
+        li = [1, 2, 3, 4, 5]
+        res = B(dummy2, type_in='gen', threads=2)
+        self.assertEqual(list(res.imap(x for x in li)), [i + 1 for i in li])
+        self.assertEqual(sorted(res.imap_unordered(x for x in li)), [i + 1 for i in li])
+    
+    def test_imap_mixed(self):
+        a = [0, 1, 2, 3]
+        # an endless generator is longer than a, which n makes split
+        res = B(dummy2, type_in='gen', chunksize=2, n=len(a)).imap((x for x in itertools.count()), b=a)
+        self.assertEqual(list(res), [0, 2, 4, 6])
+        res = B(dummy2, type_in='gen', chunksize=2).imap((x for x in range(4)), b=a)
+        self.assertEqual(list(res), [0, 2, 4, 6])
+
+    def test_imap_as_call(self):
+        # generators are split inputs of unknown length, as when calling B
+        b = B(dum_tag, type_in='gen', threads=2)
+        for n_gen, other in [(5, [7]), (3, [7, 8, 9]), (5, [7, 8, 9]), (2, [7, 8, 9]), (1, [7])]:
+            self.assertEqual(list(b.imap((x for x in range(n_gen)), b=other)),
+                             b((x for x in range(n_gen)), b=other))
+    
+    def test_imap_lazy(self):
+        pulled = []
+        
+        def gen():
+            for i in itertools.count():
+                pulled.append(i)
+                yield i
+        
+        res = B(dummy, type_in='gen', threads=2, inflight=3).imap(gen())
+        self.assertEqual(list(itertools.islice(res, 4)), [0, 1, 2, 3])
+        res.close()
+        self.assertTrue(len(pulled) <= 4 + 3)
+
+    def test_acall(self):
+        li = [1, 2, 3]
+        
+        async def main():
+            ticks = []
+            
+            async def tick():
+                while True:
+                    ticks.append(1)
+                    await asyncio.sleep(0.05)
+            
+            ticker = asyncio.ensure_future(tick())
+            res = await B(dummy_wait, threads=3).acall(li)
+            ticker.cancel()
+            return res, len(ticks)
+        
+        res, ticks = asyncio.run(main())
+        self.assertEqual(res, li)
+        # the loop kept running while the workers were busy
+        self.assertTrue(ticks > 5)
+        # the inputs are prepared off the loop
+        threads = []
+        
+        def gen():
+            threads.append(threading.current_thread())
+            yield from li
+        
+        self.assertEqual(asyncio.run(B(dummy, type_in='gen', threads=2).acall(gen())), li)
+        self.assertIsNot(threads[0], threading.current_thread())
+        # the options which are specific to calls are refused
+        for kwargs in [{'errors': 'return'}, {'timeout': 1}, {'stats': True}]:
+            with self.assertRaises(ValueError):
+                asyncio.run(B(dummy, threads=2, **kwargs).acall(li))
+    
+    def test_aimap(self):
+        li = [1, 2, 3, 4]
+        
+        async def main():
+            bf = B(dummy2, type_in='gen', threads=2)
+            ordered = [res async for res in bf.aimap(x for x in li)]
+            unordered = [res async for res in bf.aimap_unordered(x for x in li)]
+            return ordered, unordered
+        
+        ordered, unordered = asyncio.run(main())
+        self.assertEqual(ordered, [i + 1 for i in li])
+        self.assertEqual(sorted(unordered), [i + 1 for i in li])
+    
+    def test_acall_cancel(self):
+        async def main():
+            with B(dummy_wait, threads=2) as bf:
+                task = asyncio.ensure_future(bf.acall(range(10)))
+                await asyncio.sleep(0.3)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                t = time.time()
+                # only the 2 running tasks delay the next call, none is queued
+                res = await bf.acall([1, 2])
+                return res, time.time() - t
+        
+        res, elapsed = asyncio.run(main())
+        self.assertEqual(res, [1, 2])
+        self.assertTrue(elapsed < 2.3, elapsed)
+
+    def test_backend_thread(self):
+        li = [1, 2, 3]
+        res = B(lambda a: a + 1, backend='thread')(li)
+        self.assertEqual([i + 1 for i in li], res)
+    
+    def test_backend_serial(self):
+        li = [1, 2, 3]
+        res = B(lambda a: a + 1, backend='serial', chunksize='auto')(li)
+        self.assertEqual([i + 1 for i in li], res)
+        self.assertEqual(list(B(dummy, backend='serial').imap_unordered(li)), li)
+    
+    def test_backend_warm_thread(self):
+        with B(dummy, backend='thread', threads=2) as bf:
+            self.assertEqual(bf([1, 2]), [1, 2])
+            self.assertEqual(bf([3, 4]), [3, 4])
+    
+    def test_bad_backend(self):
+        with self.assertRaises(ValueError):
+            B(dummy, backend='gpu')
+    
+    def test_backend_auto(self):
+        bf = B(dummy, backend='auto', verbose=True)
+        self.assertEqual(bf._pick_backend(bf._prepare((range(4),), {}), dummy), ('serial', [0]))
+        bf = B(dummy_wait, backend='auto', threads=4)
+        self.assertEqual(bf._pick_backend(bf._prepare((range(8),), {}), dummy_wait)[0], 'thread')
+        bf = B(dum_spin, backend='auto', threads=4)
+        self.assertEqual(bf._pick_backend(bf._prepare((range(8),), {}), dum_spin)[0], 'process')
+        self.assertEqual(B(dummy2, backend='auto')(range(6), b=2), [i + 2 for i in range(6)])
+
+    def test_blocks(self):
+        li = np.arange(20.).reshape(10, 2)
+        res = B(dum_rowsum, type_in='nda', type_out='nd1', blocks=3, threads=2)(li, w=2)
+        self.assertTrue(np.all(res == li.sum(axis=1) * 2))
+        res = B(dum_rowsum, type_in='nda', blocks=True, threads=2)(li, w=np.arange(10))
+        self.assertEqual(len(res), 2)
+        self.assertTrue(np.all(np.concatenate(res) == li.sum(axis=1) * np.arange(10)))
+    
+    def test_blocks_shm_in(self):
+        li = np.arange(20.).reshape(10, 2)
+        res = B(dum_rowsum, type_in='nda', type_out='nda', blocks=4, shm_in=True)(li)
+        self.assertTrue(np.all(res == li.sum(axis=1)))
+    
+    def test_bad_blocks(self):
+        with self.assertRaises(ValueError):
+            B(dummy, blocks=0)
+
+    def test_output_pd_dtypes(self):
+        res = B(dummy_pd, type_out='df')([0, 1, 2], col=['a', 'a', 'a'])
+        self.assertEqual(res['a'].dtype, np.int64)
+        self.assertEqual(res.index.tolist(), [0, 0, 0])
+    
+    def test_input_df(self):
+        df = pd.DataFrame({'a': [1, 2, 3], 'b': [1., 2., 3.]})
+        res = B(dummy, type_in='df')(df)
+        self.assertEqual([row['b'] for row in res], [1., 2., 3.])
+        # still split element-wise by label unless requested, deprecated
+        with self.assertWarns(DeprecationWarning) as caught:
+            self.assertEqual(B(dummy2)(pd.Series([1, 2, 3])), [2, 3, 4])
+        # pointing at the caller, whichever the entry point
+        self.assertEqual(caught.filename, __file__)
+        with self.assertWarns(DeprecationWarning) as caught:
+            self.assertEqual(list(B(dummy2, backend='serial').imap(pd.Series([1, 2, 3]))), [2, 3, 4])
+        self.assertEqual(caught.filename, __file__)
+        # but not for pandas inputs kept constant
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertEqual(B(lambda a, b: a, backend='serial')([1, 2, 3, 4], b=pd.Series([0, 0])), [1, 2, 3, 4])
+    
+    def test_input_series_blocks(self):
+        s = pd.Series([1, 2, 3, 4], index=list('abcd'))
+        res = B(dummy, type_in=['series'], blocks=2)(s)
+        self.assertEqual(res[1].index.tolist(), ['c', 'd'])
+    
+    def test_input_df_groupby(self):
+        df = pd.DataFrame({'key': ['x', 'y', 'x', 'z', 'y'], 'val': [1, 2, 3, 4, 5]})
+        res = B(dum_group, type_in='df', type_out='df', groupby='key')(df, scale=2)
+        self.assertEqual(res['key'].tolist(), ['x', 'y', 'z'])
+        self.assertEqual(res['total'].tolist(), [8, 14, 8])
+        res = B(dum_group, type_in='df', type_out='df', groupby='key', blocks=2)(df)
+        self.assertEqual(len(res), 2)
+
+    def test_benchmark_compare(self):
+        from binge.benchmark import compare, run_suite
+        old = run_suite(['conversion'])
+        new = {'version': 'new', 'results': {'conversion': {k: v * 2 for k, v in old['results']['conversion'].items()}}}
+        lines = compare(old, new)
+        self.assertEqual(len(lines), len(old['results']['conversion']) + 1)
+        self.assertTrue(all(line.endswith('SLOWER') for line in lines[1:]))
+
+    def test_stats(self):
+        li = [1, 2, 3, 4]
+        bf = B(dummy, stats=True, threads=2)
+        self.assertIsNone(bf.stats)
+        self.assertEqual(bf(li), li)
+        stats = bf.stats
+        self.assertEqual(sorted(record['index'] for record in stats.tasks), [0, 1, 2, 3])
+        for phase in ('prepare', 'pool', 'run', 'post_process', 'total'):
+            self.assertIn(phase, stats.phases)
+        self.assertEqual(sum(worker['tasks'] for worker in stats.workers.values()), 4)
+        self.assertTrue(stats.bytes_in > 0 and stats.bytes_out > 0)
+        self.assertIn('phases', json.loads(stats.to_json()))
+        # sub-millisecond iterations are too noisy to expect no straggler
+        self.assertTrue(all(record in stats.tasks for record in stats.stragglers()))
+        self.assertEqual(stats.stragglers(factor=float('inf')), [])
+    
+    def test_stats_chunks_shm(self):
+        li = np.arange(12.).reshape(6, 2)
+        bf = B(dummy, type_in='nda', type_out='nda', shm_in=True, shm_out=True, chunksize='auto', stats=True)
+        self.assertTrue(np.all(bf(li) == li))
+        self.assertEqual(len(bf.stats.tasks), 5)
+    
+    def test_task_hooks(self):
+        path = os.path.join(tempfile.mkdtemp(), 'log')
+        li = [1, 2, 3]
+        bf = B(dummy, on_task_start=functools.partial(dum_log, path=path), threads=2)
+        self.assertEqual(bf(li), li)
+        with open(path) as f:
+            self.assertEqual(sorted(int(line) for line in f), [0, 1, 2])
+
+    def test_broadcast(self):
+        table = np.arange(100000)
+        bf = B(dum_table, stats=True, threads=2, inherit=False)
+        self.assertEqual(bf([1, 2, 3], table, b=[0, 1, 2], scale=2), [2, 6, 10])
+        # the table is not sent along with each task
+        self.assertTrue(max(record['bytes_in'] for record in bf.stats.tasks) < 1000)
+        res = B(dum_table, broadcast=True, chunksize=2)([1, 2, 3], table=np.array([10, 20, 30, 40]), scale=2)
+        self.assertEqual(res, [40, 60, 80])
+        res = B(dum_table, broadcast=False)([1, 2, 3], table, b=[0, 1, 2], scale=2)
+        self.assertEqual(res, [2, 6, 10])
+        # a warm pool re-uses the segment, and its workers what they loaded
+        big = DumBig()
+        with B(dum_big_loads, threads=2, broadcast=True) as bf:
+            self.assertEqual(set(bf(range(4), big)), {1})
+            bcast = bf._broadcasted
+            self.assertEqual(set(bf(range(4), big)), {1})
+            self.assertIs(bf._broadcasted, bcast)
+        self.assertIsNone(bf._broadcasted)
+    
+    def test_broadcast_imap(self):
+        table = np.array([10, 20, 30, 40])
+        res = B(dum_table, type_in='gen', broadcast=True).imap(table=table, b=[0, 0, 0], a=(x for x in range(3)))
+        self.assertEqual(list(res), [10, 20, 30])
+        res = B(dum_table, type_in='gen', broadcast=True).imap((x for x in range(3)), table, scale=(x for x in [1, 2, 3]))
+        self.assertEqual(list(res), [10, 40, 90])
+
+    def test_inherit(self):
+        if multiprocessing.get_start_method() != 'fork':
+            self.skipTest("inputs are only inherited with the fork start method")
+        # the constant input is never pickled
+        self.assertEqual(B(dum_apply, threads=2)(range(5), lambda x: 2 * x), [0, 2, 4, 6, 8])
+        with self.assertRaises(Exception):
+            B(dum_apply, threads=2, inherit=False)(range(5), lambda x: 2 * x)
+        li = list(range(10000))
+        self.assertEqual(B(dummy2, threads=2)(li, b=li), [2 * i for i in li])
+        self.assertEqual(B(dummy2, threads=2, chunksize=3)(li[:10], b=1), [i + 1 for i in li[:10]])
+        # chunksize='auto' still samples the cost of an iteration
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            res = B(dummy2, threads=2, chunksize='auto', verbose=True)(li, b=1)
+        self.assertEqual(res, [i + 1 for i in li])
+        self.assertIn("Sampled", out.getvalue())
+        li = np.arange(12.).reshape(6, 2)
+        bf = B(dummy, type_in='nda', type_out='nda', shm_out=True, stats=True, threads=2)
+        self.assertTrue(np.all(bf(li) == li))
+        self.assertEqual(sorted(record['index'] for record in bf.stats.tasks), list(range(1, 6)))
+
+    def test_worker_init(self):
+        with B(dum_state, threads=2, worker_init=dum_init) as bf:
+            res = bf(range(6)) + bf(range(6))
+        # initialized once per worker, then the state persists across calls
+        counts = {}
+        for pid, count in res:
+            counts.setdefault(pid, []).append(count)
+        self.assertEqual(sum(len(c) for c in counts.values()), 12)
+        for c in counts.values():
+            self.assertEqual(sorted(c), list(range(1, len(c) + 1)))
+        bf = B(dum_state, backend='serial', worker_init=dum_init)
+        self.assertEqual(bf(range(3)), [(os.getpid(), i) for i in (1, 2, 3)])
+        self.assertEqual(list(bf.imap(range(2))), [(os.getpid(), i) for i in (4, 5)])
+        # each B has its own state
+        bf = B(dum_state, backend='thread', threads=2, worker_init=dum_init)
+        self.assertEqual(sorted(c for _, c in bf(range(2)))[0], 1)
+
+    def test_reduce(self):
+        li = list(range(100))
+        self.assertEqual(B(dummy2, threads=2, reduce='sum')(li), sum(li) + 100)
+        self.assertEqual(B(dummy2, threads=2, reduce='max', inherit=False)(li, b=li), 198)
+        self.assertEqual(B(dummy, threads=2, reduce='min', chunksize='auto')(li), 0)
+        # order is kept for associative but not commutative reducers
+        self.assertEqual(B(str, threads=2, reduce=operator.add, chunksize=7)(range(20)),
+                         ''.join(str(i) for i in range(20)))
+        li = np.arange(12).reshape(6, 2)
+        bf = B(dummy, type_in='nda', reduce='max', stats=True, threads=2)
+        self.assertTrue(np.all(bf(li) == [10, 11]))
+        self.assertEqual(sorted(record['index'] for record in bf.stats.tasks), list(range(6)))
+        self.assertEqual(B(dummy, backend='serial', reduce='prod')([1, 2, 3, 4]), 24)
+        with self.assertRaises(ValueError):
+            B(dummy, reduce='mean')
+
+    def test_product(self):
+        res = B(dummy2, product=True, threads=2)([1, 2, 3], b=[0, 10])
+        self.assertTrue(np.all(res == [[1, 11], [2, 12], [3, 13]]))
+        bf = B(dummy2, product=True, type_in='gen', threads=2, inherit=False, chunksize=2)
+        self.assertEqual(list(bf.imap(range(2), b=(x for x in [0, 10, 20]))), [0, 10, 20, 1, 11, 21])
+        # a warm pool gets the points by chunks, computed as they are sent
+        with B(dummy2, product=True, threads=2) as bf:
+            res = bf(range(300), b=range(200))
+        self.assertEqual(res.shape, (300, 200))
+        self.assertTrue(np.all(res == np.arange(300)[:, None] + np.arange(200)))
+        # outputs keep their shape after the grid axes
+        res = B(dummy2, product=True, shm_out=True)([np.ones(3), np.zeros(3)], b=[0, 1, 2, 3])
+        self.assertEqual(res.shape, (2, 4, 3))
+        self.assertTrue(np.all(res[1, 3] == 3))
+        self.assertEqual(B(dummy2, product=True, backend='serial', reduce='sum')(range(1000), b=range(1000)), 999000000)
+        with self.assertRaises(ValueError):
+            B(dummy, product=True, blocks=2)
+
+    def test_cache(self):
+        path = tempfile.mkdtemp()
+        bf = B(dum_fail, threads=2, cache=path)
+        # interrupted run keeps the completed iterations
+        os.environ['BINGE_TEST_FAIL'] = '4'
+        try:
+            with self.assertRaises(ValueError):
+                bf(range(6))
+        finally:
+            del os.environ['BINGE_TEST_FAIL']
+        self.assertTrue(sum(len(os.listdir(os.path.join(path, d))) for d in os.listdir(path)) > 0)
+        res = B(dum_fail, threads=2, cache=path, chunksize=2, inherit=False)(range(6))
+        self.assertEqual([a for _, a in res], list(range(6)))
+        # everything is cached now, nothing runs
+        res2 = B(dum_fail, backend='serial', cache=path)(range(6))
+        self.assertEqual(res2, res)
+        self.assertNotIn(os.getpid(), [pid for pid, _ in res2])
+        # other inputs are other iterations
+        res3 = B(dum_fail, backend='serial', cache=path)(range(8))
+        self.assertEqual(res3[:6], res)
+        self.assertEqual(res3[6:], [(os.getpid(), 6), (os.getpid(), 7)])
+        B(dum_fail, backend='serial', cache=path, cache_size=0)([1])
+        self.assertEqual(sum(len(os.listdir(os.path.join(path, d))) for d in os.listdir(path)), 0)
+        with self.assertRaises(ValueError):
+            B(dummy, cache=path, reduce='sum')
+
+    def test_errors_return(self):
+        res = B(dum_once, threads=2, errors='return')(range(4), tempfile.mkdtemp())
+        self.assertTrue(all(isinstance(item, TaskError) for item in res))
+        self.assertIsInstance(res[1].error, ValueError)
+        path = tempfile.mkdtemp()
+        open(os.path.join(path, '2'), 'w').close()
+        open(os.path.join(path, '3'), 'w').close()
+        # the whole chunk fails
+        res = B(dum_once, backend='serial', errors='return', chunksize=2)(range(4), path)
+        self.assertEqual(res[2:], [2, 3])
+        self.assertEqual([item.attempts for item in res[:2]], [1, 1])
+        with self.assertRaises(ValueError):
+            B(dummy, errors='ignore')
+
+    def test_retries(self):
+        self.assertEqual(B(dum_once, threads=2, retries=1)(range(4), tempfile.mkdtemp()), [0, 1, 2, 3])
+        bf = B(dum_once, threads=2, retries=1, stats=True, inherit=False)
+        self.assertEqual(bf(range(4), tempfile.mkdtemp()), [0, 1, 2, 3])
+        self.assertEqual(sorted(record['index'] for record in bf.stats.tasks), [0, 1, 2, 3])
+        with self.assertRaises(ValueError):
+            B(dum_once, backend='thread', threads=2, retries=0, timeout=10)(range(4), tempfile.mkdtemp())
+
+    def test_timeout(self):
+        t = time.perf_counter()
+        res = B(dum_once, threads=2, timeout=0.5, errors='return')([0, 1], tempfile.mkdtemp(), sleep=[0.01, 30])
+        self.assertTrue(time.perf_counter() - t < 10)
+        self.assertEqual(res[0], 0)
+        self.assertIsInstance(res[1].error, TimeoutError)
+        # the retry does not sleep, and runs on the worker which is not stuck
+        res = B(dum_once, threads=2, timeout=0.5, retries=1)([0, 1], tempfile.mkdtemp(), sleep=[30, 0.01])
+        self.assertEqual(res, [0, 1])
+        with B(dum_once, threads=2, timeout=0.5) as bf:
+            with self.assertRaises(TimeoutError):
+                bf([0], tempfile.mkdtemp(), sleep=30)
+            # the pool stuck on the task was replaced
+            self.assertEqual(bf([0, 1], tempfile.mkdtemp(), sleep=0.01), [0, 1])
+        self.assertTrue(time.perf_counter() - t < 20)
+
+    def test_speculative(self):
+        t = time.perf_counter()
+        self.assertEqual(B(dum_once, threads=2, speculative=True)([0], tempfile.mkdtemp(), sleep=30), [0])
+        self.assertEqual(B(dum_once, backend='thread', threads=2, speculative=True)([0], tempfile.mkdtemp(), sleep=3), [0])
+        self.assertTrue(time.perf_counter() - t < 3)
+
+    def test_serializer(self):
+        li = [np.full(100000, i) for i in range(4)]
+        for serializer in ('pickle', 'pickle5'):
+            res = B(dummy2, serializer=serializer, threads=2, inherit=False)(li, b=np.ones(100000))
+            self.assertTrue(all(np.all(res[i] == i + 1) for i in range(4)))
+            res = B(dummy, serializer=serializer, threads=2, inherit=False).imap(li)
+            self.assertTrue(all(np.all(item == i) for i, item in enumerate(res)))
+        # loaded as views on shared memory, which stay valid
+        res = B(dummy, serializer='pickle5', threads=2, type_in='nda')(np.ones((4, 100000)))
+        res[2][0] = 3
+        self.assertEqual(res[2].sum(), 100002)
+        with self.assertRaises(ValueError):
+            B(dummy, serializer='json')
+
+    def test_serializer_leftovers(self):
+        # the segments of the tasks not run and of the outputs not loaded are unlinked
+        segments = set(os.listdir('/dev/shm'))
+        li = [np.full(100000, i) for i in range(20)]
+        with self.assertRaises(ValueError):
+            B(dum_fail_zero, serializer='pickle5', threads=2, inherit=False)(li)
+        it = B(dummy, serializer='pickle5', threads=2, inherit=False).imap(li[1:])
+        next(it)
+        it.close()
+        self.assertEqual(set(os.listdir('/dev/shm')) - segments, set())
+
+    def test_serializer_cloudpickle(self):
+        try:
+            import cloudpickle
+        except ImportError:
+            self.skipTest("cloudpickle is not installed")
+        scale = 3
+        bf = B(lambda x: scale * x, serializer='cloudpickle', threads=2, inherit=False)
+        self.assertEqual(bf([1, 2, 3]), [3, 6, 9])
+        self.assertEqual(list(bf.imap([1, 2])), [3, 6])
+        # also through broadcast
+        res = B(dum_apply, serializer='cloudpickle', threads=2, broadcast=True)([1, 2], lambda x: x - 1)
+        self.assertEqual(res, [0, 1])
+
+    def test_register_serializer(self):
+        register_serializer('dum', dum_dumps, dum_loads)
+        self.assertEqual(B(dummy2, serializer='dum', threads=2, broadcast=True)([1, 2], b=2), [3, 4])
+
+    def test_memmap(self):
+        li = np.arange(12.).reshape(6, 2)
+        path = os.path.join(tempfile.mkdtemp(), 'out.npy')
+        res = B(dummy, type_in='nda', type_out=path, threads=2)(li)
+        self.assertIsInstance(res, np.memmap)
+        self.assertTrue(np.all(res == li))
+        self.assertTrue(np.all(np.load(path) == li))
+        for backend in ('serial', 'thread'):
+            res = B(np.sum, type_in='nda', type_out='memmap', backend=backend, out_dtype='f4', out_shape=())(li)
+            self.assertEqual(res.dtype, np.float32)
+            self.assertTrue(np.all(res == li.sum(axis=1)))
+        res = B(dummy2, product=True, type_out='memmap')([np.ones(3), np.zeros(3)], b=[0, 1, 2, 3])
+        self.assertEqual(res.shape, (2, 4, 3))
+        res = asyncio.run(B(dummy, type_in='nda', type_out='memmap', out_path=path).acall(li))
+        self.assertTrue(np.all(res == li))
+        # the temporary file is removed once the output is collected
+        res = B(dummy, type_in='nda', type_out='memmap', threads=2)(li)
+        self.assertFalse(os.path.exists(res.filename))
+        self.assertTrue(np.all(res == li))
+        if os.path.exists('/proc/self/maps'):
+            # warm workers flush and unmap the output at the end of each chunk
+            with B(dummy, type_in='nda', type_out=path, threads=2) as b:
+                self.assertTrue(np.all(b(li) == li))
+                self.assertFalse(any(path in maps for maps in b._pool.map(dum_maps, range(4))))
+        with self.assertRaises(ValueError):
+            B(dummy, type_out='memmap', blocks=2)
+
+    def test_cluster(self):
+        ready = multiprocessing.Queue()
+        servers = [multiprocessing.Process(target=serve, args=(('127.0.0.1', 0), 2), kwargs={'ready': ready})
+                   for _ in range(2)]
+        for server in servers:
+            server.start()
+        try:
+            nodes = [ready.get(timeout=10) for _ in servers]
+            res = B(dum_node, backend='cluster', nodes=nodes, broadcast=True)(range(8), 'x' * 100000)
+            self.assertEqual([a for a, _ in res], list(range(100000, 100008)))
+            self.assertEqual({pid for _, pid in res}, {server.pid for server in servers})
+            # unreachable nodes are left out
+            with B(dummy2, backend='cluster', nodes=nodes + ['127.0.0.1:1'], serializer='cloudpickle') as b:
+                self.assertEqual(len(b._pool.nodes), 2)
+                self.assertEqual(list(b.imap([1, 2, 3])), [2, 3, 4])
+                self.assertEqual(b([1, 2, 3], b=[0, 1, 2]), [1, 3, 5])
+            with self.assertRaises(ValueError):
+                B(dummy, backend='cluster')
+            # a task whose output or error cannot be loaded fails alone
+            with B(dum_unloadable, backend='cluster', nodes=nodes) as b:
+                with self.assertRaises(ValueError):
+                    b([0, 1])
+                with self.assertRaises(multiprocessing.pool.MaybeEncodingError):
+                    b([0, 2])
+                self.assertEqual(b([0, 3]), [0, 3])
+        finally:
+            for server in servers:
+                server.terminate()
+                server.join()
+
+    def test_cluster_authkey(self):
+        # the public default key is only allowed on the loopback interface
+        os.environ.pop('BINGE_AUTHKEY', None)
+        with self.assertRaises(ValueError):
+            serve(('0.0.0.0', 0))
+        with self.assertRaises(ValueError):
+            B(dummy, backend='cluster', nodes=['192.0.2.1:5000'])([1])
+
+    def test_affinity(self):
+        from binge._affinity import core_sets, parse_cpulist
+        self.assertEqual(parse_cpulist('0-2,5,8-9\n'), [0, 1, 2, 5, 8, 9])
+        nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+        self.assertEqual(core_sets(4, nodes), [[0, 1], [4, 5], [2, 3], [6, 7]])
+        self.assertEqual(core_sets(2, nodes), [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(core_sets(5, [[0, 1]]), [[0], [1], [0], [1], [0]])
+        cpu = sorted(os.sched_getaffinity(0))[:1]
+        environ = dict(os.environ)
+        before = os.sched_getaffinity(0)
+        res = B(dum_pinned, threads=2, backend='process', affinity=[cpu], native_threads=3)(range(4))
+        self.assertEqual(res, [(cpu, '3')] * 4)
+        res = B(dum_pinned, threads=2, affinity=True, native_threads='auto')(range(4))
+        self.assertTrue(all(len(cpus) == int(n) for cpus, n in res))
+        # the calling process is left alone, even when auto runs the iterations in it
+        B(dum_pinned, affinity=[cpu], native_threads=1)(range(2))
+        self.assertEqual(os.sched_getaffinity(0), before)
+        self.assertEqual(dict(os.environ), environ)
+        for backend in ('thread', 'serial'):
+            with self.assertRaises(ValueError):
+                B(dummy, backend=backend, affinity=[cpu])
+            with self.assertRaises(ValueError):
+                B(dummy, backend=backend, native_threads=1)
+        with self.assertRaises(ValueError):
+            B(dummy, native_threads=0)
+
+    def test_start_method(self):
+        b = B(dum_loaded, threads=2, start_method='spawn')
+        self.assertFalse(b._inherits('process'))
+        self.assertEqual(b(['colorsys', 'binge']), [False, True])
+        for start_method in ('spawn', 'forkserver'):
+            res = B(dum_loaded, threads=2, start_method=start_method, preload=['colorsys'])(['colorsys'] * 2)
+            self.assertEqual(res, [True, True])
+        with self.assertRaises(ValueError):
+            B(dummy, start_method='teleport')
+        import binge
+        self.assertIn('binge', binge.__doc__)
+        self.assertIs(binge.Pipeline, Pipeline)
+        # the modules only some calls need are imported on first use
+        loaded = subprocess.run([sys.executable, '-c', "import sys, binge; print(sorted(sys.modules))"],
+                                capture_output=True, text=True, check=True).stdout
+        for module in ('binge._serialize', 'binge._pipeline', 'multiprocessing.pool', 'asyncio'):
+            self.assertNotIn(f"'{module}'", loaded)
+        # and the README only when the doc is asked for
+        read = subprocess.run([sys.executable, '-c', "import binge; print('_doc' in vars(binge))"],
+                              capture_output=True, text=True, check=True).stdout
+        self.assertEqual(read.strip(), 'False')
+
+    def test_pipeline(self):
+        pipe = B(dum_tag_pid, threads=2) | B(dum_same, threads=2)
+        self.assertIsInstance(pipe, Pipeline)
+        self.assertEqual(len(pipe._groups()), 1)
+        # fused stages run in the same worker
+        self.assertEqual(pipe(range(4)), [(j, True) for j in range(4)])
+        pipe = Pipeline(B(dummy2, backend='thread'), B(dummy2, threads=2), B(dummy2, threads=2, reduce='sum'))
+        self.assertEqual(len(pipe._groups()), 2)
+        self.assertEqual(pipe([1, 2, 3]), 15)
+        # each stage keeps its type_in and type_out
+        pipe = B(np.arange, type_out='nda') | B(np.sum, type_in='nda') | B(dummy, type_out='nd1')
+        self.assertEqual(len(pipe._groups()), 2)
+        self.assertTrue(np.all(pipe([3, 3]) == [3, 3]))
+        self.assertEqual((B(dummy2, backend='thread') | dummy2)([1, 2]), [3, 4])
+
+    def test_first(self):
+        idx, out = B(dummy, threads=2).first(dum_big, range(10))
+        self.assertTrue(dum_big(out) and idx == out)
+        self.assertIsNone(B(dummy, threads=2).first(dum_big, range(5)))
+        self.assertEqual(B(dummy, backend='serial').first(None, [0, 0, 2, 3]), (2, 2))
+        # infinite generators are consumed lazily
+        self.assertEqual(B(dummy, type_in='gen', backend='serial').first(dum_big, (j for j in itertools.count())), (6, 6))
+        t = time.perf_counter()
+        for backend in ('process', 'thread'):
+            self.assertTrue(B(dum_search, threads=2, backend=backend).any(range(1000)))
+        self.assertTrue(time.perf_counter() - t < 10)
+        self.assertFalse(B(dummy, threads=2).any([0, 0, 0]))
+        self.assertTrue(B(dummy, threads=2).all([1, 2, 3]))
+        with B(dummy, threads=2) as b:
+            pool = b._pool
+            self.assertFalse(b.all([1, 1, 0, 1]))
+            # the warm pool is not stopped by the search
+            self.assertIs(b._pool, pool)
+            self.assertEqual(b([1, 2]), [1, 2])
+        # nor is the shared pool
+        for backend in ('process', 'thread'):
+            pool = shared_pool(2, backend)
+            self.assertTrue(B(dum_search, threads=2, backend=backend, shared=True).any(range(100)))
+            self.assertIs(shared_pool(2, backend), pool)